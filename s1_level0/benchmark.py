@@ -0,0 +1,262 @@
+"""
+By: Andrew Player
+Description: Offline benchmarks of the Level-0 decoding stages on synthetic data (see synthetic.py).
+             Each stage (header parse, Huffman decoding, s-value reconstruction, full packet decoding one by one and
+             in batches, and burst assembly)
+             is timed on its own and reported in packets/s and MB/s. Results are saved as JSON so that runs on different
+             commits or machines can be compared with compare_results.
+
+             Usage: python benchmark.py --num-packets 1000 --output results.json [--baseline old_results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from bursts import assemble_rows, get_swath_bursts
+from decoding import open_mmap, scan_packet_headers, buffer_packet_generator
+from packet import Packet
+from structs import SECONDARY_HEADER_SIZE
+from synthetic import (
+    SYNTHETIC_SECONDARY_HEADER,
+    encode_fdbaq_block,
+    pack_codes,
+    pad_to_word,
+    random_fdbaq_codes,
+    write_synthetic_file,
+)
+from utils import (
+    TYPE_D_RECONSTRUCTION_TABLE,
+    create_bit_windows,
+    create_bit_words,
+    huffman_decode_block,
+    huffman_decode_streams,
+    reconstruct_s_values,
+)
+
+
+def best_time(function, repeats: int) -> float:
+    """Returns the fastest of repeats calls to function, in seconds."""
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def make_result(stage: str, data_format: str, num_packets: int, num_bytes: int, seconds: float, **parameters) -> dict:
+    return {
+        'stage': stage,
+        'data_format': data_format,
+        'packets': num_packets,
+        'bytes': num_bytes,
+        'seconds': seconds,
+        'packets_per_second': num_packets / seconds,
+        'mb_per_second': num_bytes / seconds / 1e6,
+        **parameters
+    }
+
+
+def benchmark_file_stages(filename, data_format: str, repeats: int = 3) -> list[dict]:
+    """Times the header parse, packet construction, full decode (one by one and batched), and burst assembly stages over a synthetic file."""
+    buffer = open_mmap(filename)
+    num_bytes = len(buffer)
+    header_table = scan_packet_headers(buffer)
+    num_packets = len(header_table)
+    user_data_lengths = header_table['packet_data_length'].astype(np.int64) + 1 - SECONDARY_HEADER_SIZE
+
+    def construct_packets():
+        for _ in buffer_packet_generator(buffer):
+            pass
+
+    def decode_packets():
+        for packet in buffer_packet_generator(buffer):
+            packet.get_complex_samples()
+
+    def decode_batch():
+        packets = list(buffer_packet_generator(buffer))
+        complex_samples = np.zeros((len(packets), 2 * int(header_table['num_quadratures'].max())), dtype=complex)
+        Packet.get_complex_samples_batch(packets, complex_samples)
+
+    burst_rows = get_swath_bursts(header_table, SYNTHETIC_SECONDARY_HEADER['swath_number'])[0]
+
+    return [
+        make_result('header_parse', data_format, num_packets, num_bytes, best_time(lambda: scan_packet_headers(buffer), repeats)),
+        make_result('packet_construction', data_format, num_packets, num_bytes, best_time(construct_packets, repeats)),
+        make_result('decode', data_format, num_packets, int(user_data_lengths.sum()), best_time(decode_packets, repeats)),
+        make_result('batch_decode', data_format, num_packets, int(user_data_lengths.sum()), best_time(decode_batch, repeats)),
+        make_result(
+            'assembly',
+            data_format,
+            len(burst_rows),
+            int(user_data_lengths[burst_rows].sum()),
+            best_time(lambda: assemble_rows(buffer, header_table, burst_rows), repeats)
+        ),
+    ]
+
+
+def benchmark_huffman(brc: int, num_blocks: int = 1000, repeats: int = 3, seed: int = 0) -> dict:
+    """Times huffman_decode_block over num_blocks back-to-back blocks of 128 codes encoded with brc."""
+    rng = np.random.default_rng(seed)
+    codes, code_lengths = encode_fdbaq_block(*random_fdbaq_codes(128 * num_blocks, brc, rng), brc)
+    encoded = np.packbits(pad_to_word(pack_codes(codes, code_lengths))).tobytes()
+
+    def decode_blocks():
+        windows = create_bit_windows(encoded)
+        bit_index = 0
+        for _ in range(num_blocks):
+            _, _, bit_index = huffman_decode_block(windows, bit_index, brc, 128)
+
+    # Packets/s here is blocks/s, since blocks are the unit that huffman_decode_block works on.
+    return make_result('huffman', 'D', num_blocks, len(encoded), best_time(decode_blocks, repeats), brc=brc)
+
+
+def benchmark_huffman_streams(brc: int, num_blocks: int = 1000, repeats: int = 3, seed: int = 0) -> dict:
+    """Times huffman_decode_streams over the same blocks as benchmark_huffman, with every block as its own stream."""
+    rng = np.random.default_rng(seed)
+    codes, code_lengths = encode_fdbaq_block(*random_fdbaq_codes(128 * num_blocks, brc, rng), brc)
+    block_starts = np.concatenate([[0], np.cumsum(code_lengths.reshape(num_blocks, 128).sum(axis=1))[:-1]])
+    encoded = np.packbits(pad_to_word(pack_codes(codes, code_lengths))).tobytes()
+
+    def decode_blocks():
+        words = create_bit_words(encoded, padding=256)
+        huffman_decode_streams(words, block_starts, np.full(num_blocks, brc), 128)
+
+    return make_result('huffman_streams', 'D', num_blocks, len(encoded), best_time(decode_blocks, repeats), brc=brc)
+
+
+def benchmark_reconstruction(brc: int, threshold: int, num_samples: int = 1_000_000, repeats: int = 3, seed: int = 0) -> dict:
+    """Times Type D s-value reconstruction of num_samples samples with a single BRC and threshold index."""
+    rng = np.random.default_rng(seed)
+    signs, m_codes = random_fdbaq_codes(num_samples, brc, rng)
+    signs = signs.astype(np.int8)
+    m_codes = m_codes.astype(np.uint8)
+    brcs = np.full(num_samples, brc)
+    thresholds = np.full(num_samples, threshold)
+    seconds = best_time(lambda: reconstruct_s_values(TYPE_D_RECONSTRUCTION_TABLE, brcs, thresholds, signs, m_codes), repeats)
+    # Packets/s here is blocks of 128 samples/s, and MB/s is of float64 output.
+    return make_result('reconstruction', 'D', num_samples // 128, 8 * num_samples, seconds, brc=brc, threshold=threshold)
+
+
+def run_benchmarks(
+    num_packets: int = 1000,
+    num_quads: int = 1024,
+    brcs=(0, 1, 2, 3, 4),
+    threshold: int = 100,
+    repeats: int = 3,
+    work_dir=None,
+    seed: int = 0
+) -> dict:
+    """Writes synthetic Type A, B, and D files, runs every stage benchmark, and returns the results with their settings."""
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+        for data_format in ['A', 'B', 'D']:
+            filename = os.path.join(temp_dir, f'synthetic_{data_format}.dat')
+            write_synthetic_file(filename, num_packets, data_format=data_format, num_quads=num_quads, seed=seed)
+            results.extend(benchmark_file_stages(filename, data_format, repeats))
+    for brc in brcs:
+        results.append(benchmark_huffman(brc, repeats=repeats, seed=seed))
+        results.append(benchmark_huffman_streams(brc, repeats=repeats, seed=seed))
+        results.append(benchmark_reconstruction(brc, threshold, repeats=repeats, seed=seed))
+    return {
+        'settings': {
+            'num_packets': num_packets,
+            'num_quads': num_quads,
+            'brcs': list(brcs),
+            'threshold': threshold,
+            'repeats': repeats,
+            'seed': seed,
+        },
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def save_results(benchmark: dict, filename) -> None:
+    with open(filename, 'w') as results_file:
+        json.dump(benchmark, results_file, indent=2)
+
+
+def load_results(filename) -> dict:
+    with open(filename) as results_file:
+        return json.load(results_file)
+
+
+def result_key(result: dict) -> tuple:
+    return (result['stage'], result['data_format'], result.get('brc'), result.get('threshold'))
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1) -> list[dict]:
+    """
+    Matches up the results of two runs and returns the current/baseline MB/s ratio of each stage.
+    Stages that are more than tolerance slower than the baseline are marked as regressions.
+    """
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        key = result_key(result)
+        if key not in baseline_results:
+            continue
+        ratio = result['mb_per_second'] / baseline_results[key]['mb_per_second']
+        comparisons.append({
+            'stage': key[0],
+            'data_format': key[1],
+            'brc': key[2],
+            'threshold': key[3],
+            'ratio': ratio,
+            'regression': ratio < 1 - tolerance
+        })
+    return comparisons
+
+
+def print_results(benchmark: dict) -> None:
+    for result in benchmark['results']:
+        brc = f" brc={result['brc']}" if 'brc' in result else ''
+        print(
+            f"{result['stage']:>20} {result['data_format']}{brc:7}: "
+            f"{result['packets_per_second']:12.1f} packets/s {result['mb_per_second']:10.2f} MB/s"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Level-0 decoding stages on synthetic data.')
+    parser.add_argument('--num-packets', type=int, default=1000)
+    parser.add_argument('--num-quads', type=int, default=1024)
+    parser.add_argument('--brcs', type=int, nargs='+', default=[0, 1, 2, 3, 4])
+    parser.add_argument('--threshold', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=None, help='Where the synthetic files are written (the system temp dir by default).')
+    parser.add_argument('--output', default=None, help='JSON file to save the results to.')
+    parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    benchmark = run_benchmarks(
+        num_packets = args.num_packets,
+        num_quads = args.num_quads,
+        brcs = args.brcs,
+        threshold = args.threshold,
+        repeats = args.repeats,
+        work_dir = args.work_dir,
+        seed = args.seed
+    )
+    print_results(benchmark)
+    if args.output:
+        save_results(benchmark, args.output)
+    if args.baseline:
+        for comparison in compare_results(load_results(args.baseline), benchmark):
+            brc = f" brc={comparison['brc']}" if comparison['brc'] is not None else ''
+            flag = '  REGRESSION' if comparison['regression'] else ''
+            print(f"{comparison['stage']:>20} {comparison['data_format']}{brc:7}: {comparison['ratio']:.2f}x{flag}")
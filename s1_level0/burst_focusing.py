@@ -0,0 +1,515 @@
+"""
+By: Andrew Player
+Description: Sentinel-1 TOPS burst focusing, packaged from the burst chain of level_1.ipynb:
+                 1. range_compress_burst: matched filtering against the replica chirp from the burst's header.
+                 2. get_fine_dc_estimates: fine Doppler centroids of the range compressed burst after DCE preconditioning.
+                 3. range_spreading_loss_correction, and range_doppler_transform (the azimuth FFT).
+                 4. secondary_range_compression, range_cell_migration_correction, and azimuth_compression, which run
+                    together on line_block azimuth lines (Doppler frequencies) at a time, followed by the inverse azimuth FFT.
+             Every stage works in place on the one (azimuth, range) burst buffer, which can be complex64: the FFTs overwrite
+             their input, the notebook's fftshifts are folded into phase ramps, and anything that varies along both axes
+             (velocities, Doppler frequencies, and the SRC, RCMC, and azimuth filters) is only built a block of lines at a time.
+             Everything that only depends on the burst geometry (its shape, dtype, and the GEOMETRY_FIELDS of its header) is
+             set up once in a BurstGeometry, which get_burst_geometry caches, so the bursts of a swath share one set of range
+             axes, matched filter spectrum, and FFT ramps.
+             focus_bursts focuses the bursts of every sub-swath of a Level-0 file across a process pool. Each worker decodes
+             a burst straight into its working buffer and saves the image to a .npy file, so that it holds at most that
+             buffer and the block temporaries.
+
+             Example:
+                 images = focus_bursts('s1a-iw-raw.dat', 'images/', swath_numbers=[10, 11, 12])
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from scipy.constants import pi, c
+from scipy.fft import fft, ifft
+from scipy.interpolate import interp1d
+from scipy.ndimage import map_coordinates
+
+from bursts import ECHO_SIGNAL_TYPE, get_swath_bursts, assemble_rows
+from decoding import open_mmap, close_mmap, scan_packet_headers, read_buffer_packet
+from range_compression import get_replica_chirp
+from structs import F_REF, RANGE_DECIMATION_TO_SAMPLE_RATE
+from sub_commutated import decode_sub_commutated_data
+
+
+S1_CENTER_FREQUENCY = 5.405000454334350e+09
+S1_WAVELENGTH = c / S1_CENTER_FREQUENCY
+
+WGS84_MAJOR_A = 6_378_137.0
+WGS84_MINOR_B = 6_356_752.3142
+
+DELTA_T_SUPPRESSED = (320 / (8 * F_REF)) * 1e-6
+LATCH_TIME = 1.439e-6
+
+NUM_AZIMUTH_BEAM_ADDRESSES = 1024
+MAX_STEERING_ANGLE = 0.018
+
+NUM_FINE_DC_RANGE_BLOCKS = 15
+LINE_BLOCK = 64
+
+# The secondary header fields (see Packet.get_secondary_header) that a BurstGeometry depends on.
+GEOMETRY_FIELDS = (
+    'range_decimation',
+    'tx_ramp_rate',
+    'tx_pulse_start_frequency',
+    'pulse_length',
+    'rank',
+    'pri',
+    'swst',
+    'num_quads'
+)
+
+
+def fft_in_place(x: np.ndarray, axis: int, inverse: bool = False, workers: int = None) -> None:
+    """FFTs (or inverse FFTs) x along axis in place. scipy.fft's own backend already does this with overwrite_x."""
+    result = (ifft if inverse else fft)(x, axis=axis, overwrite_x=True, workers=workers)
+    if not np.shares_memory(result, x):
+        x[...] = result
+
+
+def get_shift_ramp(num_samples: int, shift: int, dtype=complex) -> np.ndarray:
+    """
+    Returns exp(2j * pi * n * shift / num_samples). Multiplying a spectrum by it circularly shifts its inverse FFT by shift
+    samples to the left, and multiplying a signal by it circularly shifts its FFT by shift samples to the right.
+    """
+    n = np.arange(num_samples, dtype=np.int64)
+    return np.exp(2j * pi * ((n * shift) % num_samples) / num_samples).astype(dtype)
+
+
+class BurstGeometry:
+    """
+    The range axes, matched filter spectrum, and FFT ramps of (num_az, num_rng) bursts of dtype, given the GEOMETRY_FIELDS
+    of their header (in the units of Packet.get_secondary_header: us and MHz). Use get_burst_geometry to share them.
+    """
+
+    def __init__(
+            self,
+            num_az: int,
+            num_rng: int,
+            dtype,
+            range_decimation: int,
+            tx_ramp_rate: float,
+            tx_pulse_start_frequency: float,
+            pulse_length: float,
+            rank: int,
+            pri: float,
+            swst: float,
+            num_quads: int
+    ):
+        self.shape = (num_az, num_rng)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.complex64, np.complex128):
+            raise ValueError(f'Bursts must be complex64 or complex128, got {self.dtype}.')
+        self.pri  = pri * 1e-6
+        self.prf  = 1 / self.pri
+        self.rank = rank
+        self.swst = swst * 1e-6
+
+        self._set_range_axes(range_decimation, pulse_length, num_quads)
+        self._set_matched_filter(tx_ramp_rate, tx_pulse_start_frequency, pulse_length, range_decimation)
+
+        # fftshift after the azimuth FFT, as a ramp along azimuth before it.
+        self.azimuth_shift_ramp = get_shift_ramp(num_az, num_az // 2, self.dtype)[:, np.newaxis]
+
+
+    def _set_range_axes(self, range_decimation: int, pulse_length: float, num_quads: int):
+        """Sets the slant ranges and range times of the samples, as get_slant_ranges and get_slant_range_times do in the notebook."""
+        num_rng = self.shape[1]
+        delay = self.rank * self.pri + self.swst + DELTA_T_SUPPRESSED
+        self.slant_ranges = np.linspace(delay * c / 2, (delay + pulse_length * 1e-6) * c / 2, num_rng)
+        num_replica_samples = int(np.floor(RANGE_DECIMATION_TO_SAMPLE_RATE[range_decimation] * pulse_length))
+        self.sampling_length = ((2 * num_quads / num_replica_samples) * pulse_length * 1e-6)
+        self.range_times = np.linspace(delay, delay + self.sampling_length, num_rng)
+        self.range_time_offsets = self.range_times - self.range_times[0]
+        range_sample_rate = 1 / (self.range_times[1] - self.range_times[0])
+        self.range_frequencies = np.linspace(-range_sample_rate / 2, range_sample_rate / 2, num_rng)
+        self.spreading_loss = (np.sqrt(self.slant_ranges[0] / self.slant_ranges) ** 3).astype(np.finfo(self.dtype).dtype)
+
+
+    def _set_matched_filter(self, tx_ramp_rate: float, tx_pulse_start_frequency: float, pulse_length: float, range_decimation: int):
+        """Sets conj(fft(replica)) for the replica centered in a line, times the ramp that does the notebook's ifftshift."""
+        num_rng = self.shape[1]
+        replica = get_replica_chirp(tx_ramp_rate, tx_pulse_start_frequency, pulse_length, range_decimation)
+        replica_start = int(np.ceil((num_rng - replica.shape[0]) / 2)) - 1
+        reference = np.zeros(num_rng, dtype=complex)
+        reference[replica_start:replica_start + replica.shape[0]] = replica
+        self.matched_filter = (np.conj(fft(reference)) * get_shift_ramp(num_rng, num_rng // 2)).astype(self.dtype)
+
+
+@lru_cache(maxsize=16)
+def get_cached_burst_geometry(num_az: int, num_rng: int, dtype, *field_values) -> BurstGeometry:
+    return BurstGeometry(num_az, num_rng, dtype, *field_values)
+
+
+def get_burst_geometry(header: dict, shape: tuple[int, int], dtype=np.complex64) -> BurstGeometry:
+    """Returns the (cached) BurstGeometry of bursts of shape and dtype whose first packet has the secondary header header."""
+    return get_cached_burst_geometry(*shape, np.dtype(dtype), *(header[field] for field in GEOMETRY_FIELDS))
+
+
+def get_azimuth_steering_angles(azimuth_beam_addresses) -> np.ndarray:
+    """Returns the azimuth steering angle (radians) of each azimuth beam address."""
+    azimuth_angles = np.linspace(-MAX_STEERING_ANGLE, MAX_STEERING_ANGLE, NUM_AZIMUTH_BEAM_ADDRESSES)
+    return azimuth_angles[np.asarray(azimuth_beam_addresses, dtype=np.intp)]
+
+
+def get_doppler_centroid_rate(velocity, steering_angles: np.ndarray, pri: float) -> float:
+    """Returns the Doppler centroid rate (Hz/s) due to the antenna steering over a burst, given the pri in s."""
+    steering_rate = (steering_angles[-1] - steering_angles[0]) / (pri * steering_angles.shape[0])
+    return (-2 * np.linalg.norm(velocity) * steering_rate) / S1_WAVELENGTH
+
+
+def get_effective_velocities(positions: np.ndarray, velocities: np.ndarray, slant_ranges: np.ndarray) -> np.ndarray:
+    """Returns the (num_lines, num_rng) effective velocities of lines with (num_lines, 3) ECEF positions and velocities."""
+    heights = np.linalg.norm(positions, axis=1)
+    lat = np.arctan(positions[:, 2] / positions[:, 0])
+    local_earth_rad = np.sqrt(
+        (np.square(WGS84_MAJOR_A**2 * np.cos(lat)) + np.square(WGS84_MINOR_B**2 * np.sin(lat))) /
+        (np.square(WGS84_MAJOR_A * np.cos(lat)) + np.square(WGS84_MINOR_B * np.sin(lat)))
+    )[:, np.newaxis]
+    heights = heights[:, np.newaxis]
+    v = np.linalg.norm(velocities, axis=1)[:, np.newaxis]
+    cos_beta = (np.square(local_earth_rad) + np.square(heights) - np.square(slant_ranges)) / (2 * local_earth_rad * heights)
+    ground_velocities = local_earth_rad * v * cos_beta / heights
+    return np.sqrt(v * ground_velocities)
+
+
+def get_doppler_lines(
+    geometry: BurstGeometry,
+    doppler_centroids: np.ndarray,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    lines: slice
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the (num_lines, num_rng) azimuth frequencies, effective velocities, and range migration factors (D) of a block
+    of lines of a burst in the range-Doppler domain, where the azimuth frequencies of each range column span the prf
+    around its Doppler centroid.
+    """
+    num_az = geometry.shape[0]
+    line_numbers = np.arange(lines.start, lines.stop)[:, np.newaxis]
+    azimuth_frequencies = (doppler_centroids - geometry.prf / 2) + line_numbers * (geometry.prf / (num_az - 1))
+    effective_velocities = get_effective_velocities(positions[lines], velocities[lines], geometry.slant_ranges)
+    rcmc_factor = np.sqrt(
+        1 - ((c**2) * (azimuth_frequencies**2)) / ((4 * effective_velocities**2) * (S1_CENTER_FREQUENCY**2))
+    )
+    return azimuth_frequencies, effective_velocities, rcmc_factor
+
+
+def range_compress_burst(burst: np.ndarray, geometry: BurstGeometry, workers: int = None) -> None:
+    """Range compresses a burst in place."""
+    fft_in_place(burst, 1, workers=workers)
+    burst *= geometry.matched_filter
+    fft_in_place(burst, 1, inverse=True, workers=workers)
+
+
+def range_spreading_loss_correction(burst: np.ndarray, geometry: BurstGeometry) -> None:
+    burst /= geometry.spreading_loss
+
+
+def range_doppler_transform(burst: np.ndarray, geometry: BurstGeometry, workers: int = None) -> None:
+    """Takes a burst to the range-Doppler domain in place, with the zero Doppler frequency in the middle line."""
+    burst *= geometry.azimuth_shift_ramp
+    fft_in_place(burst, 0, workers=workers)
+
+
+def get_deramping_signal(num_az: int, doppler_centroid_rate: float, burst_duration: float) -> np.ndarray:
+    az_time = np.linspace(0, burst_duration, num_az)
+    return np.exp(1j * pi * doppler_centroid_rate * (az_time - 0.5 * burst_duration)**2)
+
+
+def average_phase_increment(burst: np.ndarray, deramping_signal: np.ndarray = None, line_block: int = LINE_BLOCK) -> np.ndarray:
+    """
+    Returns the angle of the sum of x[n] * conj(x[n + 1]) along azimuth for each range column, where x is the burst times
+    the deramping_signal along azimuth. This is the same as that of dce_preconditioning(burst) in the notebook, but
+    without making a preconditioned copy of the burst.
+    """
+    num_az, num_rng = burst.shape
+    phase_difference_sum = np.zeros(num_rng, dtype=np.complex128)
+    for start in range(0, num_az - 1, line_block):
+        stop = min(start + line_block, num_az - 1)
+        products = burst[start:stop] * np.conj(burst[start + 1:stop + 1])
+        if deramping_signal is not None:
+            products *= (deramping_signal[start:stop] * np.conj(deramping_signal[start + 1:stop + 1]))[:, np.newaxis]
+        phase_difference_sum += products.sum(axis=0, dtype=np.complex128)
+    return np.angle(phase_difference_sum)
+
+
+def unwrap_fine_dc_estimates(fine_dc_estimates: np.ndarray, prf: float, kTs: np.ndarray) -> np.ndarray:
+    num_est = fine_dc_estimates.shape[0]
+
+    dt = kTs[1] - kTs[0]
+    F_ = np.pad(np.floor(np.abs(np.exp(1j * 2 * pi * fine_dc_estimates / prf))), (0, 8 * num_est))
+    F = fft(F_)
+    v_index = np.argmax(np.abs(F) ** 2)
+    v = np.fft.fftfreq(8 * num_est, d=dt)[v_index]
+
+    a = v / dt
+    b = np.angle(F[v_index]) / (2 * pi)
+
+    res = np.exp(1j * 2 * pi * fine_dc_estimates / prf) * np.exp(-1j * (a * kTs + b))
+    res = np.angle(res) / (2 * pi)
+
+    return (a * kTs + b + res) * prf
+
+
+def get_fine_dc_estimates(
+    burst: np.ndarray,
+    geometry: BurstGeometry,
+    doppler_centroid_rate: float,
+    burst_duration: float,
+    line_block: int = LINE_BLOCK
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (num_rng, ) Doppler centroids of a range compressed burst, from its average phase increments after DCE
+    preconditioning, averaged over NUM_FINE_DC_RANGE_BLOCKS range blocks and fit with a cubic in range time, along with
+    the fit's coefficients.
+    """
+    num_az, num_rng = burst.shape
+    deramping_signal = get_deramping_signal(num_az, doppler_centroid_rate, burst_duration)
+    phase_differences = average_phase_increment(burst, deramping_signal, line_block)
+    wrapped_fine_dc_estimates = -geometry.prf * phase_differences / (2 * pi)
+
+    rng_block_size = num_rng // NUM_FINE_DC_RANGE_BLOCKS
+    fine_dc_blocks = np.zeros((NUM_FINE_DC_RANGE_BLOCKS, ), dtype=complex)
+    for i in range(NUM_FINE_DC_RANGE_BLOCKS):
+        start_index = i * rng_block_size
+        end_index = start_index + rng_block_size if start_index + rng_block_size < num_rng else num_rng - 1
+        fine_dc_blocks[i] = np.sum(wrapped_fine_dc_estimates[start_index:end_index]) / (end_index - start_index)
+
+    times = np.linspace(0, geometry.sampling_length, NUM_FINE_DC_RANGE_BLOCKS)
+    unwrapped = unwrap_fine_dc_estimates(fine_dc_blocks, geometry.prf, times)
+    poly = np.polyfit(times, np.abs(geometry.prf / unwrapped), deg=3)
+    return np.polyval(poly, geometry.range_time_offsets), poly
+
+
+def secondary_range_compression(
+    lines: np.ndarray,
+    geometry: BurstGeometry,
+    azimuth_frequencies: np.ndarray,
+    effective_velocities: np.ndarray,
+    rcmc_factor: np.ndarray,
+    workers: int = None
+) -> None:
+    """Applies SRC in place to a block of range-Doppler lines, given their outputs of get_doppler_lines."""
+    # exp(-1j * pi * f_r**2 / K_src), written with 1 / K_src so that the zero Doppler frequency needs no special case.
+    inverse_k_src = (c * geometry.slant_ranges * azimuth_frequencies**2) / (
+        2 * effective_velocities**2 * S1_CENTER_FREQUENCY**3 * rcmc_factor**2
+    )
+    fft_in_place(lines, 1, workers=workers)
+    lines *= np.exp(-1j * pi * geometry.range_frequencies**2 * inverse_k_src)
+    fft_in_place(lines, 1, inverse=True, workers=workers)
+
+
+def range_cell_migration_correction(
+    lines: np.ndarray,
+    geometry: BurstGeometry,
+    rcmc_factor: np.ndarray,
+    order: int = 3,
+    mode: str = 'nearest'
+) -> None:
+    """
+    Shifts each range-Doppler line in place by slant_ranges / |D| - slant_ranges samples, with spline interpolation of order.
+    As the lines are not shifted along azimuth, interpolating a block of them gives the same lines as interpolating the burst.
+    """
+    num_lines, num_rng = lines.shape
+    rcmc_shift = (geometry.slant_ranges / np.abs(rcmc_factor)) - geometry.slant_ranges
+    coords = np.stack(np.broadcast_arrays(np.arange(num_lines)[:, np.newaxis], np.arange(num_rng) + rcmc_shift))
+    lines[...] = map_coordinates(lines, coords, output=lines.dtype, order=order, mode=mode)
+
+
+def azimuth_compression(
+    lines: np.ndarray,
+    geometry: BurstGeometry,
+    azimuth_frequencies: np.ndarray,
+    rcmc_factor: np.ndarray,
+    azimuth_bandwidth: float = None
+) -> None:
+    """
+    Multiplies a block of range-Doppler lines in place by the azimuth matched filter, including the instrument timing and
+    bistatic delay corrections. The inverse azimuth FFT, which finishes azimuth compression, is left to the caller.
+    The filter has unit magnitude, so the notebook's energy normalization (E) is 1 and is left out, and the antenna
+    pattern sums cancel out of its antenna energy compensation, leaving sqrt(prf / azimuth_bandwidth).
+    """
+    azimuth_bandwidth = azimuth_bandwidth or geometry.prf
+    instrument_timing_correction = geometry.swst + LATCH_TIME
+    bistatic_delay_correction = (geometry.swst + geometry.rank * geometry.pri - geometry.range_time_offsets) / 2
+    phase = (
+        4 * pi * geometry.slant_ranges * S1_CENTER_FREQUENCY * rcmc_factor / c +
+        2 * pi * azimuth_frequencies * (instrument_timing_correction + bistatic_delay_correction)
+    )
+    az_filter = np.exp(1j * phase)
+    az_filter *= np.sqrt(geometry.prf / azimuth_bandwidth)
+    lines *= az_filter
+
+
+def focus_range_doppler(
+    burst: np.ndarray,
+    geometry: BurstGeometry,
+    doppler_centroids: np.ndarray,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    azimuth_bandwidth: float = None,
+    line_block: int = LINE_BLOCK,
+    workers: int = None
+) -> None:
+    """Runs SRC, RCMC, and azimuth compression in place on a range-Doppler burst, line_block lines at a time."""
+    num_az = burst.shape[0]
+    for start in range(0, num_az, line_block):
+        lines = slice(start, min(start + line_block, num_az))
+        azimuth_frequencies, effective_velocities, rcmc_factor = get_doppler_lines(
+            geometry, doppler_centroids, positions, velocities, lines
+        )
+        secondary_range_compression(burst[lines], geometry, azimuth_frequencies, effective_velocities, rcmc_factor, workers)
+        range_cell_migration_correction(burst[lines], geometry, rcmc_factor)
+        azimuth_compression(burst[lines], geometry, azimuth_frequencies, rcmc_factor, azimuth_bandwidth)
+    fft_in_place(burst, 0, inverse=True, workers=workers)
+
+
+def focus_burst(
+    burst: np.ndarray,
+    header: dict,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    azimuth_beam_addresses,
+    burst_duration: float,
+    azimuth_bandwidth: float = None,
+    line_block: int = LINE_BLOCK,
+    workers: int = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Focuses a (num_az, num_rng) complex64 or complex128 burst in place, and returns it along with its (num_rng, ) Doppler
+    centroids. header is the secondary header of the burst's first packet (Packet.get_secondary_header), positions and
+    velocities are the (num_az, 3) ECEF state of the sensor at each line, and burst_duration is in s.
+    """
+    geometry = get_burst_geometry(header, burst.shape, burst.dtype)
+    positions = np.asarray(positions, dtype=np.float64)
+    velocities = np.asarray(velocities, dtype=np.float64)
+
+    range_compress_burst(burst, geometry, workers)
+
+    steering_angles = get_azimuth_steering_angles(azimuth_beam_addresses)
+    doppler_centroid_rate = get_doppler_centroid_rate(velocities[0], steering_angles, geometry.pri)
+    doppler_centroids, _ = get_fine_dc_estimates(burst, geometry, doppler_centroid_rate, burst_duration, line_block)
+
+    range_spreading_loss_correction(burst, geometry)
+    range_doppler_transform(burst, geometry, workers)
+    focus_range_doppler(burst, geometry, doppler_centroids, positions, velocities, azimuth_bandwidth, line_block, workers)
+    return burst, doppler_centroids
+
+
+def get_packet_times(header_table: np.ndarray) -> np.ndarray:
+    """Returns the GPS time (s) of each packet in a header table (from decoding.scan_packet_headers)."""
+    return header_table['coarse_time'].astype(np.float64) + (header_table['fine_time'].astype(np.float64) + 0.5) * 2.0**-16
+
+
+def get_state_vector_functions(sub_commutated_data: dict):
+    """
+    Returns functions of GPS time that linearly interpolate (and extrapolate) the positions and velocities of
+    sub_commutated.decode_sub_commutated_data, ignoring repeated POD solutions.
+    """
+    pod_times, unique_indices = np.unique(sub_commutated_data['pod_times'], return_index=True)
+    get_position = interp1d(pod_times, sub_commutated_data['positions'][unique_indices], axis=0, fill_value='extrapolate')
+    get_velocity = interp1d(pod_times, sub_commutated_data['velocities'][unique_indices], axis=0, fill_value='extrapolate')
+    return get_position, get_velocity
+
+
+def focus_burst_to_file(
+    filename,
+    burst_headers: np.ndarray,
+    positions: np.ndarray,
+    velocities: np.ndarray,
+    output,
+    dtype=np.complex64,
+    line_block: int = LINE_BLOCK
+):
+    """Decodes the burst with the header table records burst_headers from filename, focuses it, and saves it to the .npy file output."""
+    buffer = open_mmap(filename)
+    try:
+        burst = assemble_rows(buffer, burst_headers, np.arange(len(burst_headers)), dtype)
+        header = read_buffer_packet(buffer, int(burst_headers['offset'][0])).get_secondary_header()
+    finally:
+        close_mmap(buffer)
+    packet_times = get_packet_times(burst_headers)
+    focus_burst(
+        burst,
+        header,
+        positions,
+        velocities,
+        burst_headers['azimuth_beam_address'],
+        packet_times[-1] - packet_times[0],
+        line_block = line_block
+    )
+    np.save(output, burst)
+    return output
+
+
+def get_burst_jobs(header_table: np.ndarray, swath_numbers, burst_numbers=None) -> list[tuple[int, int, np.ndarray]]:
+    """
+    Returns (swath number, burst number, header table rows) for the selected bursts of each swath. burst_numbers is None
+    (every burst), burst numbers for every swath, or a dict of burst numbers by swath number (every burst of a swath that
+    is not in it). Raises IndexError for a burst number that a swath does not have.
+    """
+    jobs = []
+    for swath_number in swath_numbers:
+        swath_number = int(swath_number)
+        swath_bursts = get_swath_bursts(header_table, swath_number)
+        swath_burst_numbers = burst_numbers.get(swath_number) if isinstance(burst_numbers, dict) else burst_numbers
+        if swath_burst_numbers is None:
+            swath_burst_numbers = range(len(swath_bursts))
+        for burst_number in swath_burst_numbers:
+            if not 0 <= burst_number < len(swath_bursts):
+                raise IndexError(f'Swath {swath_number} has {len(swath_bursts)} bursts, so there is no burst {burst_number}.')
+            jobs.append((swath_number, burst_number, swath_bursts[burst_number]))
+    return jobs
+
+
+def focus_bursts(
+    filename,
+    output_dir,
+    swath_numbers=None,
+    burst_numbers=None,
+    num_workers: int = None,
+    dtype=np.complex64,
+    line_block: int = LINE_BLOCK
+) -> dict[tuple[int, int], str]:
+    """
+    Focuses the selected bursts (see get_burst_jobs) of the selected swaths (all of them if None) of a Level-0 file across
+    a process pool of num_workers (os.cpu_count() by default), saving each to
+    output_dir/swath_{swath_number}_burst_{burst_number}.npy. Returns the filenames by (swath number, burst number).
+    Every selection is checked before any burst is focused.
+    """
+    buffer = open_mmap(filename)
+    try:
+        header_table = scan_packet_headers(buffer)
+    finally:
+        close_mmap(buffer)
+    get_position, get_velocity = get_state_vector_functions(
+        decode_sub_commutated_data(header_table['sc_data_word_index'], header_table['sc_data_word'])
+    )
+    if swath_numbers is None:
+        swath_numbers = np.unique(header_table['swath_number'][header_table['signal_type'] == ECHO_SIGNAL_TYPE])
+    jobs = get_burst_jobs(header_table, swath_numbers, burst_numbers)
+    os.makedirs(output_dir, exist_ok=True)
+    futures = {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for swath_number, burst_number, rows in jobs:
+            burst_headers = header_table[rows]
+            packet_times = get_packet_times(burst_headers)
+            futures[(swath_number, burst_number)] = executor.submit(
+                focus_burst_to_file,
+                filename,
+                burst_headers,
+                get_position(packet_times),
+                get_velocity(packet_times),
+                os.path.join(output_dir, f'swath_{swath_number}_burst_{burst_number}.npy'),
+                dtype,
+                line_block
+            )
+        return {key: future.result() for key, future in futures.items()}
@@ -0,0 +1,86 @@
+"""
+By: Andrew Player
+Description: Assembly of swaths and bursts into 2-D complex sample matrices.
+             Packets are selected from the header table made by decoding.scan_packet_headers, the output matrix
+             is sized from those headers (lines x max samples, zero padded), and each packet decodes straight into its own row.
+"""
+
+import numpy as np
+
+from decoding import open_mmap, scan_packet_headers, read_buffer_packet
+from packet import Packet
+
+
+ECHO_SIGNAL_TYPE = 0
+
+
+def get_swath_rows(header_table: np.ndarray, swath_number: int, signal_type: int = ECHO_SIGNAL_TYPE) -> np.ndarray:
+    """Returns the header table rows of the packets in a swath (only those of signal_type, unless it is None)."""
+    in_swath = header_table['swath_number'] == swath_number
+    if signal_type is not None:
+        in_swath &= header_table['signal_type'] == signal_type
+    return np.flatnonzero(in_swath)
+
+
+def split_bursts(header_table: np.ndarray, rows: np.ndarray) -> list[np.ndarray]:
+    """
+    Splits the rows of a swath into bursts. A new burst starts whenever the azimuth beam address
+    neither stays the same nor steps up by one from the previous packet.
+    """
+    if len(rows) == 0:
+        return []
+    azimuth_beam_addresses = header_table['azimuth_beam_address'][rows].astype(np.int64)
+    steps = np.diff(azimuth_beam_addresses)
+    burst_starts = np.flatnonzero((steps != 0) & (steps != 1)) + 1
+    return np.split(rows, burst_starts)
+
+
+def get_swath_bursts(header_table: np.ndarray, swath_number: int, signal_type: int = ECHO_SIGNAL_TYPE) -> list[np.ndarray]:
+    return split_bursts(header_table, get_swath_rows(header_table, swath_number, signal_type))
+
+
+def assemble_rows(buffer, header_table: np.ndarray, rows: np.ndarray, dtype=np.complex64) -> np.ndarray:
+    """
+    Decodes the packets at the given header table rows into one (len(rows), max samples) matrix of dtype.
+    Lines with fewer samples, or packets that fail to decode, are left zero padded.
+    The packets are decoded together with Packet.get_complex_samples_batch.
+    """
+    num_samples = 2 * header_table['num_quadratures'][rows].astype(np.int64)
+    max_samples = int(num_samples.max()) if len(rows) > 0 else 0
+    samples = np.zeros((len(rows), max_samples), dtype=dtype)
+    buffer = memoryview(buffer)
+    packets = [read_buffer_packet(buffer, int(offset)) for offset in header_table['offset'][rows]]
+    Packet.get_complex_samples_batch(packets, samples)
+    return samples
+
+
+def assemble_bursts(
+    filename,
+    swath_number: int,
+    burst_numbers=None,
+    dtype=np.complex64,
+    signal_type: int = ECHO_SIGNAL_TYPE
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Returns (samples, headers) for each selected burst of a swath, where headers are the header table
+    records of the burst's lines. All bursts are assembled if burst_numbers is None.
+    """
+    buffer = open_mmap(filename)
+    header_table = scan_packet_headers(buffer)
+    swath_bursts = get_swath_bursts(header_table, swath_number, signal_type)
+    if burst_numbers is None:
+        burst_numbers = range(len(swath_bursts))
+    return [
+        (assemble_rows(buffer, header_table, swath_bursts[burst_number], dtype), header_table[swath_bursts[burst_number]])
+        for burst_number in burst_numbers
+    ]
+
+
+def assemble_burst(
+    filename,
+    swath_number: int,
+    burst_number: int,
+    dtype=np.complex64,
+    signal_type: int = ECHO_SIGNAL_TYPE
+) -> tuple[np.ndarray, np.ndarray]:
+    return assemble_bursts(filename, swath_number, [burst_number], dtype, signal_type)[0]
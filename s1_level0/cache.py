@@ -0,0 +1,170 @@
+"""
+By: Andrew Player
+Description: Opt-in on-disk cache of decoded bursts.
+             Each burst is stored as a memory-mappable .npy file (plus its header records), keyed by the identity of
+             the Level-0 file, the swath, the burst, the signal type, and the output dtype. The cache is kept under a size
+             limit by evicting the least recently used entries, where a hit counts as a use.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from bursts import ECHO_SIGNAL_TYPE, assemble_rows, get_swath_bursts
+from decoding import open_mmap, scan_packet_headers
+
+
+SAMPLES_SUFFIX = '_samples.npy'
+HEADERS_SUFFIX = '_headers.npy'
+
+
+def file_identity(filename, use_hash: bool = False) -> str:
+    """
+    Identifies a file by its size and modification time, or by the SHA-256 of its contents if use_hash is set
+    (slower, but survives copies and touches).
+    """
+    if not use_hash:
+        stat = os.stat(filename)
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as raw_data:
+        for chunk in iter(lambda: raw_data.read(1 << 24), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BurstCache:
+    def __init__(self, cache_dir, max_bytes: int = 32 * 2**30, use_hash: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.use_hash  = use_hash
+        self.__hashes  = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+    def identity(self, filename) -> str:
+        """
+        Returns the file_identity of filename as it is now. Content hashes are remembered for the file's
+        (path, size, mtime), so a file is only hashed again once it has changed.
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        if not self.use_hash:
+            return f'{stat.st_size}-{stat.st_mtime_ns}'
+        stat_key = (path, stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self.__hashes:
+            self.__hashes[stat_key] = file_identity(path, use_hash=True)
+        return self.__hashes[stat_key]
+
+
+    def key(self, filename, swath_number: int, burst_number: int, dtype=np.complex64, signal_type: int = ECHO_SIGNAL_TYPE) -> str:
+        key_parts = f'{self.identity(filename)}|{swath_number}|{burst_number}|{signal_type}|{np.dtype(dtype).str}'
+        return hashlib.sha1(key_parts.encode()).hexdigest()
+
+
+    def __paths(self, key: str) -> tuple[str, str]:
+        return (
+            os.path.join(self.cache_dir, key + SAMPLES_SUFFIX),
+            os.path.join(self.cache_dir, key + HEADERS_SUFFIX)
+        )
+
+
+    def get(self, key: str):
+        """Returns (memory-mapped samples, headers) for key, or None on a miss."""
+        samples_path, headers_path = self.__paths(key)
+        try:
+            samples = np.load(samples_path, mmap_mode='r')
+            headers = np.load(headers_path)
+        except FileNotFoundError:
+            return None
+        os.utime(samples_path)
+        return samples, headers
+
+
+    def put(self, key: str, samples: np.ndarray, headers: np.ndarray) -> None:
+        samples_path, headers_path = self.__paths(key)
+        for path, array in ((headers_path, headers), (samples_path, samples)):
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as cache_file:
+                np.save(cache_file, array)
+            os.replace(temp_path, path)
+        self.evict()
+
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """Returns (last use time, size in bytes, key) for every cached burst, least recently used first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(SAMPLES_SUFFIX):
+                continue
+            key = name[:-len(SAMPLES_SUFFIX)]
+            samples_path, headers_path = self.__paths(key)
+            try:
+                samples_stat = os.stat(samples_path)
+                size = samples_stat.st_size + os.stat(headers_path).st_size
+            except FileNotFoundError:
+                continue
+            entries.append((samples_stat.st_mtime, size, key))
+        return sorted(entries)
+
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+
+    def evict(self, max_bytes: int = None) -> None:
+        """Removes least recently used bursts until the cache is no larger than max_bytes (self.max_bytes by default)."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= max_bytes:
+                break
+            for path in self.__paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+    def clear(self) -> None:
+        self.evict(0)
+
+
+    def get_bursts(
+        self,
+        filename,
+        swath_number: int,
+        burst_numbers,
+        dtype=np.complex64,
+        signal_type: int = ECHO_SIGNAL_TYPE
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Same as bursts.assemble_bursts, but cached bursts are memory-mapped from the cache and only
+        the missing ones are decoded (with a single header scan) and added to it.
+        """
+        keys = [self.key(filename, swath_number, burst_number, dtype, signal_type) for burst_number in burst_numbers]
+        results = [self.get(key) for key in keys]
+        if any(result is None for result in results):
+            buffer = open_mmap(filename)
+            header_table = scan_packet_headers(buffer)
+            swath_bursts = get_swath_bursts(header_table, swath_number, signal_type)
+            for i, burst_number in enumerate(burst_numbers):
+                if results[i] is None:
+                    rows = swath_bursts[burst_number]
+                    results[i] = (assemble_rows(buffer, header_table, rows, dtype), header_table[rows])
+                    self.put(keys[i], *results[i])
+        return results
+
+
+    def get_burst(
+        self,
+        filename,
+        swath_number: int,
+        burst_number: int,
+        dtype=np.complex64,
+        signal_type: int = ECHO_SIGNAL_TYPE
+    ) -> tuple[np.ndarray, np.ndarray]:
+        return self.get_bursts(filename, swath_number, [burst_number], dtype, signal_type)[0]
@@ -1,20 +1,35 @@
+import logging
+import mmap
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
 from structs import (
     PRIMARY_HEADER_SIZE,
     SECONDARY_HEADER_SIZE,
     WORD_SIZE,
-    PRIMARY_HEADER,
-    PRIMARY_HEADER_FIELDS,
-    SECONDARY_HEADER,
-    SECONDARY_HEADER_FIELDS,
+    SYNC_MARKER,
     SUB_COMM_KEY_POS,
     SUB_COMM_KEY_VAL,
 )
 
+from headers import (
+    PRIMARY_HEADER_LAYOUT,
+    SECONDARY_HEADER_LAYOUT,
+    PACKET_RECORD_DTYPE,
+    PACKET_RECORD_PRIMARY_FIELDS,
+    PACKET_RECORD_SECONDARY_FIELDS
+)
 from packet import Packet
+from stats import DECODE_STATS
 from utils import create_bit_string
 
-# TODO: Implement use of the annot.dat file to grab the locations of each packet
-#       so that packet processing can be parallelized.
+
+logger = logging.getLogger(__name__)
+
 
 def get_header_dict(header_bytes, header_bit_lengths, header_field_names):
     read_and_pop = lambda bit_string, bit_length: (bit_string[0:bit_length], bit_string[bit_length:])
@@ -33,29 +48,417 @@ def get_header_dict(header_bytes, header_bit_lengths, header_field_names):
     return header_dict
 
 
-def packet_generator(raw_data):
+def make_header_filter(field_values: dict):
+    """
+    Compiles field=value constraints, e.g. {'swath_number': 10, 'signal_type': 0}, into a header filter for the
+    packet generators. A value can also be a collection of accepted values, e.g. {'polarisation': {1, 2}}.
+    Fields are looked up in the secondary header first, then the primary header, and are decoded straight from the raw header bytes.
+    """
+    checks = []
+    for name, value in field_values.items():
+        accepted = set(value) if isinstance(value, (set, frozenset, list, tuple, range)) else {value}
+        if name in SECONDARY_HEADER_LAYOUT.fields:
+            checks.append((1, SECONDARY_HEADER_LAYOUT.fields[name], accepted))
+        elif name in PRIMARY_HEADER_LAYOUT.fields:
+            checks.append((0, PRIMARY_HEADER_LAYOUT.fields[name], accepted))
+        else:
+            raise ValueError(f'{name} is not a header field.')
+
+    def header_filter(primary_header, secondary_header) -> bool:
+        headers = (primary_header, secondary_header)
+        for header_index, field, accepted in checks:
+            value = int.from_bytes(headers[header_index][field.byte_start:field.byte_end], 'big')
+            if ((value >> field.shift) & field.mask) not in accepted:
+                return False
+        return True
+
+    return header_filter
+
+
+def get_header_filter(header_filter):
+    """Returns header_filter as a predicate(primary_header, secondary_header), compiling it if it is a dict of field values."""
+    if header_filter is None or callable(header_filter):
+        return header_filter
+    return make_header_filter(header_filter)
+
+
+def packet_generator(raw_data, header_filter=None):
+    """
+    Yields the packets of an open Level-0 file. header_filter is either a predicate(primary_header, secondary_header)
+    on the raw header bytes or a dict of field values (see make_header_filter). The user data of packets that do
+    not pass it is skipped with a seek, without being read.
+    Stops at the end of the file, and raises ValueError on a truncated packet.
+    """
+    header_filter = get_header_filter(header_filter)
     while raw_data:
-        primary_header_bytes = raw_data.read(PRIMARY_HEADER_SIZE)
-        primary_header = get_header_dict(primary_header_bytes, PRIMARY_HEADER, PRIMARY_HEADER_FIELDS)
-        secondary_header_bytes = raw_data.read(SECONDARY_HEADER_SIZE)
-        secondary_header = get_header_dict(secondary_header_bytes, SECONDARY_HEADER, SECONDARY_HEADER_FIELDS)
-        packet_data_length = primary_header['packet_data_length']
+        start_time = DECODE_STATS.start()
+        primary_header = raw_data.read(PRIMARY_HEADER_SIZE)
+        if len(primary_header) == 0:
+            DECODE_STATS.stop('io', start_time)
+            return
+        secondary_header = raw_data.read(SECONDARY_HEADER_SIZE)
+        if len(primary_header) != PRIMARY_HEADER_SIZE or len(secondary_header) != SECONDARY_HEADER_SIZE:
+            raise ValueError(f'Expected {PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE} header bytes, got {len(primary_header) + len(secondary_header)}.')
         user_data = None
-        if packet_data_length:
-            packet_data_length = int(packet_data_length, 2)
-            user_data_length = (packet_data_length + 1) - SECONDARY_HEADER_SIZE
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header, 'packet_data_length')
+        user_data_length = (packet_data_length + 1) - SECONDARY_HEADER_SIZE
+        if header_filter is not None and not header_filter(primary_header, secondary_header):
             if user_data_length > 0:
-                user_data = raw_data.read(user_data_length)
-        yield Packet(
+                raw_data.seek(user_data_length, os.SEEK_CUR)
+            DECODE_STATS.stop('io', start_time)
+            continue
+        if user_data_length > 0:
+            user_data = raw_data.read(user_data_length)
+            if len(user_data) != user_data_length:
+                raise ValueError(f'Expected {user_data_length} user data bytes, got {len(user_data)}.')
+        DECODE_STATS.stop('io', start_time)
+        start_time = DECODE_STATS.start()
+        packet = Packet(
             primary_header = primary_header,
             secondary_header = secondary_header,
             user_data_field = user_data
         )
+        DECODE_STATS.stop('header_parse', start_time)
+        yield packet
 
 
-def packet_generator_from_file(filename):
+def packet_generator_from_file(filename, header_filter=None):
     with open(filename, 'rb') as data:
-        return packet_generator(data)
+        yield from packet_generator(data, header_filter)
+
+
+def scan_packet_offsets(raw_data) -> np.ndarray:
+    """
+    Returns the byte offset of every packet in raw_data by reading only the primary headers and
+    seeking over the rest of each packet. This is the fallback when there are no annotation/index files.
+    """
+    offsets = []
+    offset = 0
+    raw_data.seek(offset)
+    while True:
+        primary_header_bytes = raw_data.read(PRIMARY_HEADER_SIZE)
+        if len(primary_header_bytes) < PRIMARY_HEADER_SIZE:
+            break
+        offsets.append(offset)
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header_bytes, 'packet_data_length')
+        offset += PRIMARY_HEADER_SIZE + packet_data_length + 1
+        raw_data.seek(offset)
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def record_column(records, name: str, dtype=np.int64) -> np.ndarray:
+    """Returns a field of index or annotation records as an array, whether they are a structured array or a list of dicts."""
+    if isinstance(records, np.ndarray):
+        return records[name].astype(dtype)
+    return np.asarray([record[name] for record in records], dtype=dtype)
+
+
+def packet_offsets_from_records(annotation_records, index_records=None) -> np.ndarray:
+    """
+    Returns the byte offset of every packet from the packet lengths in the annotation records
+    (one record per packet). If index records are given, the offsets are checked against their byte offsets.
+    """
+    packet_lengths = record_column(annotation_records, 'packet_length')
+    offsets = np.zeros(packet_lengths.shape, dtype=np.int64)
+    offsets[1:] = np.cumsum(packet_lengths[:-1])
+    if index_records is not None and len(index_records) > 0:
+        packet_indices = record_column(index_records, 'unit_offset') - 1
+        byte_offsets = record_column(index_records, 'byte_offset')
+        in_range = (packet_indices >= 0) & (packet_indices < len(offsets))
+        mismatches = np.flatnonzero(in_range & (offsets[np.clip(packet_indices, 0, max(len(offsets) - 1, 0))] != byte_offsets))
+        if len(mismatches) > 0:
+            packet_index = packet_indices[mismatches[0]]
+            raise ValueError(
+                f'Annotation packet lengths do not match the index at packet {packet_index}: '
+                f'{offsets[packet_index]} != {byte_offsets[mismatches[0]]}. Use scan_packet_offsets instead.'
+            )
+    return offsets
+
+
+def annotation_times(annotation_records) -> np.ndarray:
+    """Returns the (uplink) acquisition time of each annotation record in seconds since Jan. 1, 2000."""
+    return (
+        record_column(annotation_records, 'days_ul', np.float64) * 86400 +
+        record_column(annotation_records, 'milliseconds_ul', np.float64) * 1e-3 +
+        record_column(annotation_records, 'microseconds_ul', np.float64) * 1e-6
+    )
+
+
+def packet_indices_in_time_window(packet_times, start_time, end_time) -> np.ndarray:
+    """Returns the indices of the packets with start_time <= time < end_time."""
+    packet_times = np.asarray(packet_times)
+    return np.flatnonzero((packet_times >= start_time) & (packet_times < end_time))
+
+
+def read_packet(raw_data, offset: int) -> Packet:
+    raw_data.seek(offset)
+    primary_header = raw_data.read(PRIMARY_HEADER_SIZE)
+    secondary_header = raw_data.read(SECONDARY_HEADER_SIZE)
+    if len(primary_header) != PRIMARY_HEADER_SIZE or len(secondary_header) != SECONDARY_HEADER_SIZE:
+        raise ValueError(f'Expected {PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE} header bytes, got {len(primary_header) + len(secondary_header)}.')
+    packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header, 'packet_data_length')
+    user_data_length = (packet_data_length + 1) - SECONDARY_HEADER_SIZE
+    user_data = None
+    if user_data_length > 0:
+        user_data = raw_data.read(user_data_length)
+        if len(user_data) != user_data_length:
+            raise ValueError(f'Expected {user_data_length} user data bytes, got {len(user_data)}.')
+    return Packet(
+        primary_header = primary_header,
+        secondary_header = secondary_header,
+        user_data_field = user_data,
+        offset = offset
+    )
+
+
+def read_buffer_packet(buffer, offset: int) -> Packet:
+    """Same as read_packet, but for a bytes-like buffer (e.g. from open_mmap). The Packet gets views of its bytes."""
+    buffer = memoryview(buffer)
+    user_data_start = offset + PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE
+    primary_header = buffer[offset:offset + PRIMARY_HEADER_SIZE]
+    packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header, 'packet_data_length')
+    packet_end = offset + PRIMARY_HEADER_SIZE + packet_data_length + 1
+    if packet_end > len(buffer):
+        raise ValueError(f'Truncated packet at byte offset {offset}: ends at {packet_end} of {len(buffer)}.')
+    return Packet(
+        primary_header = primary_header,
+        secondary_header = buffer[offset + PRIMARY_HEADER_SIZE:user_data_start],
+        user_data_field = buffer[user_data_start:packet_end] if packet_end > user_data_start else None,
+        offset = offset
+    )
+
+
+def packets_at_offsets(raw_data, offsets):
+    for offset in offsets:
+        yield read_packet(raw_data, int(offset))
+
+
+def _decode_packets_at_offsets(filename, offsets):
+    with open(filename, 'rb') as raw_data:
+        packets = list(packets_at_offsets(raw_data, offsets))
+    num_samples = [2 * packet.num_quads() for packet in packets]
+    complex_samples = np.zeros((len(packets), max(num_samples, default=0)), dtype=complex)
+    num_bytes = Packet.get_complex_samples_batch(packets, complex_samples)
+    return [
+        None if packet_bytes is None else (samples[:packet_samples], packet_bytes)
+        for samples, packet_samples, packet_bytes in zip(complex_samples, num_samples, num_bytes)
+    ]
+
+
+def decode_packets_parallel(filename, offsets, num_workers: int = None, chunk_size: int = 256) -> list:
+    """
+    Decodes the complex samples of the packets at offsets across a process pool.
+    Each worker opens the file itself and decodes chunk_size packets at a time, together (see Packet.get_complex_samples_batch).
+    The results are returned in the same order as offsets.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    chunks = [offsets[i:i+chunk_size] for i in range(0, len(offsets), chunk_size)]
+    complex_samples = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk_samples in executor.map(_decode_packets_at_offsets, repeat(filename), chunks):
+            complex_samples.extend(chunk_samples)
+    return complex_samples
+
+
+def open_mmap(filename):
+    """Memory-maps filename read-only. The map is closed once nothing references it (or a view of it) anymore."""
+    with open(filename, 'rb') as raw_data:
+        if os.fstat(raw_data.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(raw_data.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_mmap(buffer) -> None:
+    """Closes a map from open_mmap (there is nothing to close for an empty file). Views of it must be released first."""
+    if isinstance(buffer, mmap.mmap):
+        buffer.close()
+
+
+def buffer_packet_generator(buffer, offset: int = 0, header_filter=None, base_offset: int = 0):
+    """
+    Yields the packets in a bytes-like buffer (e.g. from open_mmap) starting at offset.
+    Headers are decoded straight from the buffer and each Packet gets a memoryview of its user data,
+    so no packet bytes are copied. Stops at the end of the buffer.
+    Packets that do not pass header_filter (see packet_generator) are skipped without building a Packet.
+    base_offset is added to the offsets given to the packets, for buffers that hold part of a file.
+    """
+    header_filter = get_header_filter(header_filter)
+    buffer = memoryview(buffer)
+    buffer_size = len(buffer)
+    header_size = PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE
+    while offset < buffer_size:
+        if offset + header_size > buffer_size:
+            raise ValueError(f'Truncated packet headers at byte offset {base_offset + offset}.')
+        user_data_start = offset + header_size
+        primary_header = buffer[offset:offset + PRIMARY_HEADER_SIZE]
+        secondary_header = buffer[offset + PRIMARY_HEADER_SIZE:user_data_start]
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header, 'packet_data_length')
+        packet_end = offset + PRIMARY_HEADER_SIZE + packet_data_length + 1
+        if packet_end > buffer_size:
+            raise ValueError(f'Truncated packet at byte offset {base_offset + offset}: ends at {base_offset + packet_end} of {base_offset + buffer_size}.')
+        if header_filter is not None and not header_filter(primary_header, secondary_header):
+            offset = packet_end
+            continue
+        user_data = buffer[user_data_start:packet_end] if packet_end > user_data_start else None
+        start_time = DECODE_STATS.start()
+        packet = Packet(
+            primary_header = primary_header,
+            secondary_header = secondary_header,
+            user_data_field = user_data,
+            offset = base_offset + offset
+        )
+        DECODE_STATS.stop('header_parse', start_time)
+        yield packet
+        offset = packet_end
+
+
+def mmap_packet_generator(filename, offset: int = 0, header_filter=None):
+    return buffer_packet_generator(open_mmap(filename), offset, header_filter)
+
+
+SYNC_MARKER_OFFSET = PRIMARY_HEADER_SIZE + SECONDARY_HEADER_LAYOUT.fields['sync_marker'].byte_start
+SYNC_MARKER_BYTES = np.frombuffer(SYNC_MARKER.to_bytes(4, 'big'), dtype=np.uint8)
+
+
+def find_sync_markers(buffer, start: int = 0, end: int = None) -> np.ndarray:
+    """Returns the start offsets of every packet in buffer[start:end] whose secondary header has a valid sync marker."""
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    end = len(raw) if end is None else min(end, len(raw))
+    first = start + SYNC_MARKER_OFFSET
+    last = end - (PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE) + SYNC_MARKER_OFFSET + 1  # Room for the whole header.
+    if last <= first:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.flatnonzero(raw[first:last] == SYNC_MARKER_BYTES[0])
+    for i in range(1, 4):
+        candidates = candidates[raw[first + candidates + i] == SYNC_MARKER_BYTES[i]]
+    return candidates.astype(np.int64) + start
+
+
+def has_sync_marker(buffer, offset: int) -> bool:
+    marker_start = offset + SYNC_MARKER_OFFSET
+    return bytes(buffer[marker_start:marker_start + 4]) == SYNC_MARKER_BYTES.tobytes()
+
+
+def is_valid_packet_start(buffer, offset: int) -> bool:
+    """
+    Checks that a packet starts at offset: it has a sync marker, and it either ends exactly at the end of
+    the buffer or is followed by another packet with a sync marker.
+    """
+    buffer_size = len(buffer)
+    if offset + PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE > buffer_size or not has_sync_marker(buffer, offset):
+        return False
+    packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(buffer[offset:offset + PRIMARY_HEADER_SIZE], 'packet_data_length')
+    packet_end = offset + PRIMARY_HEADER_SIZE + packet_data_length + 1
+    return packet_end == buffer_size or has_sync_marker(buffer, packet_end)
+
+
+def find_next_packet(buffer, start: int, chunk_size: int = 2**26) -> int:
+    """
+    Returns the offset of the first valid packet (see is_valid_packet_start) at or after start,
+    or len(buffer) if there is none. The buffer is searched chunk_size bytes at a time.
+    """
+    buffer_size = len(buffer)
+    chunk_overlap = PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE
+    chunk_start = start
+    while chunk_start < buffer_size:
+        for offset in find_sync_markers(buffer, chunk_start, chunk_start + chunk_size + chunk_overlap):
+            if chunk_start + chunk_size <= offset:
+                break
+            if is_valid_packet_start(buffer, int(offset)):
+                return int(offset)
+        chunk_start += chunk_size
+    return buffer_size
+
+
+def resilient_packet_generator(buffer, offset: int = 0, skipped_ranges: list = None, log: bool = True):
+    """
+    Same as buffer_packet_generator, but every packet must have a sync marker and be followed by one (or by the end
+    of the buffer). When a packet fails that check, e.g. because its packet_data_length is corrupted, the bytes up to
+    the next valid packet are skipped, and the skipped (start, end) byte range is appended to skipped_ranges.
+    Since a packet's length can only be trusted if the next header is intact, the packet before a damaged header is skipped too.
+    Each skipped range is logged as a warning, unless log is False.
+    """
+    buffer = memoryview(buffer)
+    buffer_size = len(buffer)
+    while offset < buffer_size:
+        if not is_valid_packet_start(buffer, offset):
+            next_offset = find_next_packet(buffer, offset + 1)
+            if skipped_ranges is not None:
+                skipped_ranges.append((offset, next_offset))
+            if log:
+                logger.warning('Skipped %d bytes of damaged data at byte offset %d.', next_offset - offset, offset)
+            offset = next_offset
+            continue
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(buffer[offset:offset + PRIMARY_HEADER_SIZE], 'packet_data_length')
+        yield read_buffer_packet(buffer, offset)
+        offset += PRIMARY_HEADER_SIZE + packet_data_length + 1
+
+
+def resilient_mmap_packet_generator(filename, offset: int = 0, skipped_ranges: list = None, log: bool = True):
+    return resilient_packet_generator(open_mmap(filename), offset, skipped_ranges, log)
+
+
+def buffer_packet_offsets(buffer) -> np.ndarray:
+    """Returns the byte offset of every packet with complete headers in a bytes-like buffer."""
+    buffer = memoryview(buffer)
+    header_size = PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE
+    last_offset = len(buffer) - header_size
+    offsets = []
+    offset = 0
+    while offset <= last_offset:
+        offsets.append(offset)
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(
+            buffer[offset:offset + PRIMARY_HEADER_SIZE],
+            'packet_data_length'
+        )
+        offset += PRIMARY_HEADER_SIZE + packet_data_length + 1
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def _gather_packet_headers(buffer, offsets) -> np.ndarray:
+    """Returns the (primary + secondary) header bytes of the packets at offsets as an (N, 68) uint8 array."""
+    header_size = PRIMARY_HEADER_SIZE + SECONDARY_HEADER_SIZE
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    return raw[offsets[:, np.newaxis] + np.arange(header_size)]
+
+
+def scan_packet_headers(buffer, offsets=None) -> np.ndarray:
+    """
+    Decodes the headers of every packet in a bytes-like buffer (e.g. from open_mmap) without touching any user data.
+    Returns a structured array with one record per packet: the byte offset, the packet sequence count and data length
+    from the primary header, and every (non-spare) secondary header field as raw integers.
+    """
+    start_time = DECODE_STATS.start()
+    if offsets is None:
+        offsets = buffer_packet_offsets(buffer)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    header_bytes = _gather_packet_headers(buffer, offsets)
+    columns = {'offset': offsets}
+    columns.update(PRIMARY_HEADER_LAYOUT.decode_array(header_bytes[:, :PRIMARY_HEADER_SIZE], PACKET_RECORD_PRIMARY_FIELDS))
+    columns.update(SECONDARY_HEADER_LAYOUT.decode_array(header_bytes[:, PRIMARY_HEADER_SIZE:], PACKET_RECORD_SECONDARY_FIELDS))
+    header_table = np.empty(len(offsets), dtype=PACKET_RECORD_DTYPE)
+    for name, column in columns.items():
+        header_table[name] = column
+    DECODE_STATS.stop('header_scan', start_time)
+    return header_table
+
+
+def scan_secondary_header_fields(buffer, field_names, offsets=None) -> dict[str, np.ndarray]:
+    """Same as scan_packet_headers, but only decodes the given secondary header fields, into a dict of column arrays."""
+    if offsets is None:
+        offsets = buffer_packet_offsets(buffer)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    header_bytes = _gather_packet_headers(buffer, offsets)
+    return SECONDARY_HEADER_LAYOUT.decode_array(header_bytes[:, PRIMARY_HEADER_SIZE:], field_names)
+
+
+def scan_packet_headers_from_file(filename) -> np.ndarray:
+    return scan_packet_headers(open_mmap(filename))
+
+
+def packets_to_records(packets) -> np.ndarray:
+    """Returns the typed header records (the same layout as scan_packet_headers) of already built packets."""
+    return np.array([packet.to_record() for packet in packets], dtype=PACKET_RECORD_DTYPE)
 
 
 def build_data_word_dict(packet_generator, num_packets: int = 100, log: bool = True, log_interval: int = 10):
@@ -91,7 +494,85 @@ def build_data_word_dict(packet_generator, num_packets: int = 100, log: bool = T
     return data_word_dicts
 
 
-def index_decoder(raw_data):
+INDEX_RECORD_RAW_DTYPE = np.dtype([
+    ('date_time', '>u8'),
+    ('time_delta', '>u8'),
+    ('data_size', '>u4'),
+    ('unit_offset', '>u4'),
+    ('byte_offset', '>u8'),
+    ('variable_flag', 'u1'),
+    ('spare_data', 'u1', (3, )),
+])
+
+INDEX_RECORD_DTYPE = np.dtype([
+    ('date_time', np.uint64),
+    ('time_delta', np.uint64),
+    ('data_size', np.uint32),
+    ('unit_offset', np.uint32),
+    ('byte_offset', np.uint64),
+    ('variable_flag', np.uint8),
+    ('spare_data', np.uint32),
+])
+
+# The flag fields from bit_1_type to spare_field are unpacked from the 32-bit word at octet 21.
+ANNOTATION_RECORD_RAW_DTYPE = np.dtype({
+    'names': [
+        'days_ul', 'milliseconds_ul', 'microseconds_ul', 'days_dl', 'milliseconds_dl', 'microseconds_dl',
+        'packet_length', 'num_transfer_frames', 'error_flag', 'flags'
+    ],
+    'formats': ['>u2', '>u4', '>u2', '>u2', '>u4', '>u2', '>u2', '>u2', 'u1', '>u4'],
+    'offsets': [0, 2, 6, 8, 10, 14, 16, 18, 20, 21],
+    'itemsize': 26,
+})
+
+ANNOTATION_FLAG_FIELDS = [
+    # (name, shift, mask) within the 32-bit flags word.
+    ('bit_1_type', 31, 0x1),
+    ('bit_2_type', 29, 0x3),
+    ('bit_6_type', 23, 0x3F),
+    ('spare_field', 15, 0xFF),
+]
+
+ANNOTATION_RECORD_DTYPE = np.dtype([
+    ('days_ul', np.uint16),
+    ('milliseconds_ul', np.uint32),
+    ('microseconds_ul', np.uint16),
+    ('days_dl', np.uint16),
+    ('milliseconds_dl', np.uint32),
+    ('microseconds_dl', np.uint16),
+    ('packet_length', np.uint16),
+    ('num_transfer_frames', np.uint16),
+    ('error_flag', np.uint8),
+    ('bit_1_type', np.uint8),
+    ('bit_2_type', np.uint8),
+    ('bit_6_type', np.uint8),
+    ('spare_field', np.uint8),
+])
+
+
+def read_raw_records(raw_data, raw_dtype: np.dtype) -> np.ndarray:
+    """
+    Reads every whole record of raw_dtype from an open file (from its current position), a filename,
+    or a bytes-like buffer. A trailing partial record is ignored.
+    """
+    if isinstance(raw_data, (str, os.PathLike)):
+        raw_bytes = np.fromfile(raw_data, dtype=np.uint8)
+    elif hasattr(raw_data, 'read'):
+        raw_bytes = np.frombuffer(raw_data.read(), dtype=np.uint8)
+    else:
+        raw_bytes = np.frombuffer(raw_data, dtype=np.uint8)
+    num_records = len(raw_bytes) // raw_dtype.itemsize
+    return raw_bytes[:num_records * raw_dtype.itemsize].view(raw_dtype)
+
+
+def records_to_dicts(records: np.ndarray) -> list[dict]:
+    """Returns the list of dicts (of Python ints) view of decoded index or annotation records."""
+    names = records.dtype.names
+    columns = [records[name].tolist() for name in names]
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def index_decoder(raw_data, as_dicts: bool = False):
     """
     Block Index: 36 Octets
         Date/Time: 8 Octets (MJD 1950)
@@ -101,26 +582,22 @@ def index_decoder(raw_data):
         Bytes Offset from File Beginning: 8 Octets (0 indexed)
         Variable Data Size Flag: 1 Octet
         Spare Data to Align to 36 Bytes: 3 Octets
+
+    raw_data is an open index file, a filename, or a buffer. Returns a structured array (INDEX_RECORD_DTYPE) with
+    one record per block, so records['byte_offset'] is a column and records[i]['byte_offset'] a single value,
+    or the old list of dicts if as_dicts is set.
     """
-    index_records = []
-    while raw_data:
-        data = raw_data.read(36)
-        if not data:
-            break
-        record = {
-            'date_time': int.from_bytes(data[0:8], 'big'),
-            'time_delta': int.from_bytes(data[8:16], 'big'),
-            'data_size': int.from_bytes(data[16:20], 'big'),
-            'unit_offset': int.from_bytes(data[20:24], 'big'),
-            'byte_offset': int.from_bytes(data[24:32], 'big'),
-            'variable_flag': int.from_bytes(data[32:33], 'big'),
-            'spare_data': int.from_bytes(data[33:36], 'big'),
-        }
-        index_records.append(record)
-    return index_records
+    raw_records = read_raw_records(raw_data, INDEX_RECORD_RAW_DTYPE)
+    index_records = np.empty(len(raw_records), dtype=INDEX_RECORD_DTYPE)
+    for name in INDEX_RECORD_DTYPE.names:
+        if name != 'spare_data':
+            index_records[name] = raw_records[name]
+    spare_data = raw_records['spare_data'].astype(np.uint32)
+    index_records['spare_data'] = (spare_data[:, 0] << 16) | (spare_data[:, 1] << 8) | spare_data[:, 2]
+    return records_to_dicts(index_records) if as_dicts else index_records
 
 
-def annotation_decoder(raw_data):
+def annotation_decoder(raw_data, as_dicts: bool = False):
     """
     Annotation Record: 26 Octets
         Aquisition Time: 2 Octets (utc time, days since Jan 1. 2000)
@@ -133,27 +610,16 @@ def annotation_decoder(raw_data):
         Bit 2 Type: 2 Bits (2-bit bit mask)
         Bit 6 Type: 6 Bits (6-bit bit mask)
         Spare Field: 1 Octet
+
+    raw_data is an open annotation file, a filename, or a buffer. Returns a structured array (ANNOTATION_RECORD_DTYPE)
+    with one record per packet, or the old list of dicts if as_dicts is set.
     """
-    annotation_records = []
-    while raw_data:
-        data = raw_data.read(26)
-        if not data:
-            break
-        bit_string = create_bit_string(data)
-        record = {
-            'days_ul': int(bit_string[0:16], 2),
-            'milliseconds_ul': int(bit_string[16:48], 2),
-            'microseconds_ul': int(bit_string[48:64], 2),
-            'days_dl': int(bit_string[64:80], 2),
-            'milliseconds_dl': int(bit_string[80:112], 2),
-            'microseconds_dl': int(bit_string[112:128], 2),
-            'packet_length': int(bit_string[128:144], 2),
-            'num_transfer_frames': int(bit_string[144:160], 2),
-            'error_flag': int(bit_string[160:168], 2),
-            'bit_1_type': int(bit_string[168:169], 2),
-            'bit_2_type': int(bit_string[169:171], 2),
-            'bit_6_type': int(bit_string[171:177], 2),
-            'spare_field': int(bit_string[177:185], 2)
-        }
-        annotation_records.append(record)
-    return annotation_records
\ No newline at end of file
+    raw_records = read_raw_records(raw_data, ANNOTATION_RECORD_RAW_DTYPE)
+    annotation_records = np.empty(len(raw_records), dtype=ANNOTATION_RECORD_DTYPE)
+    for name in ANNOTATION_RECORD_RAW_DTYPE.names:
+        if name != 'flags':
+            annotation_records[name] = raw_records[name]
+    flags = raw_records['flags']
+    for name, shift, mask in ANNOTATION_FLAG_FIELDS:
+        annotation_records[name] = (flags >> shift) & mask
+    return records_to_dicts(annotation_records) if as_dicts else annotation_records
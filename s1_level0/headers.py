@@ -0,0 +1,122 @@
+"""
+By: Andrew Player
+Description: Compiled layouts for the Space Packet primary and secondary headers.
+             The bit lengths and field names from structs.py are turned into byte offsets, shifts, and masks once,
+             so that headers can be decoded with integer operations, either one at a time or many at once from
+             a NumPy array of raw header bytes.
+"""
+
+import numpy as np
+
+from structs import (
+    PRIMARY_HEADER,
+    PRIMARY_HEADER_FIELDS,
+    SECONDARY_HEADER,
+    SECONDARY_HEADER_FIELDS,
+)
+
+
+class HeaderField:
+    __slots__ = ('name', 'bit_offset', 'bit_length', 'byte_start', 'byte_end', 'shift', 'int_shift', 'mask')
+
+    def __init__(self, name: str, bit_offset: int, bit_length: int, header_bits: int):
+        self.name       = name
+        self.bit_offset = bit_offset
+        self.bit_length = bit_length
+        self.byte_start = bit_offset // 8
+        self.byte_end   = (bit_offset + bit_length + 7) // 8
+        self.shift      = 8 * self.byte_end - (bit_offset + bit_length)  # Shift within the spanned bytes.
+        self.int_shift  = header_bits - (bit_offset + bit_length)        # Shift within the whole header.
+        self.mask       = (1 << bit_length) - 1
+
+    def __repr__(self) -> str:
+        return f'HeaderField({self.name}, bit_offset={self.bit_offset}, bit_length={self.bit_length})'
+
+
+class HeaderLayout:
+    def __init__(self, header_bit_lengths, header_field_names):
+        if len(header_bit_lengths) != len(header_field_names):
+            raise ValueError('The number of field names and header values does not match.')
+        num_bits = sum(header_bit_lengths)
+        if num_bits % 8 != 0:
+            raise ValueError(f'Header length of {num_bits} bits is not a whole number of bytes.')
+        self.num_bits    = num_bits
+        self.num_bytes   = num_bits // 8
+        self.field_names = list(header_field_names)
+        self.field_index = {name: index for index, name in enumerate(header_field_names)}
+        self.fields      = {}
+        bit_offset = 0
+        for name, bit_length in zip(header_field_names, header_bit_lengths):
+            self.fields[name] = HeaderField(name, bit_offset, bit_length, num_bits)
+            bit_offset += bit_length
+        self.__int_fields = [(field.int_shift, field.mask) for field in self.fields.values()]
+
+
+    def decode_values(self, header_bytes) -> tuple[int, ...]:
+        """Decodes every field of a single header into a tuple of integers, in field_names order."""
+        if len(header_bytes) != self.num_bytes:
+            raise ValueError(f'Expected {self.num_bytes} header bytes, got {len(header_bytes)}.')
+        value = int.from_bytes(header_bytes, 'big')
+        return tuple((value >> shift) & mask for shift, mask in self.__int_fields)
+
+
+    def decode(self, header_bytes) -> dict[str, int]:
+        """Decodes every field of a single header into a dict of integers."""
+        return dict(zip(self.field_names, self.decode_values(header_bytes)))
+
+
+    def decode_field(self, header_bytes, name: str) -> int:
+        """Decodes a single field, only touching the bytes that it spans."""
+        field = self.fields[name]
+        value = int.from_bytes(header_bytes[field.byte_start:field.byte_end], 'big')
+        return (value >> field.shift) & field.mask
+
+
+    def field_dtype(self, name: str) -> np.dtype:
+        bit_length = self.fields[name].bit_length
+        for dtype in (np.uint8, np.uint16, np.uint32):
+            if bit_length <= 8 * np.dtype(dtype).itemsize:
+                return np.dtype(dtype)
+        return np.dtype(np.uint64)
+
+
+    def decode_array(self, headers, field_names=None) -> dict[str, np.ndarray]:
+        """
+        Decodes many headers at once. headers is anything that can be viewed as an (N, num_bytes) uint8 array,
+        such as a 2-D array of stacked headers or a buffer of N back-to-back headers.
+        Returns a dict of column arrays, one per field in field_names (all fields by default).
+        """
+        headers = np.asarray(headers, dtype=np.uint8)
+        if headers.ndim == 1:
+            headers = headers.reshape(-1, self.num_bytes)
+        if headers.shape[1] != self.num_bytes:
+            raise ValueError(f'Expected headers of {self.num_bytes} bytes, got {headers.shape[1]}.')
+        if field_names is None:
+            field_names = self.field_names
+        columns = {}
+        for name in field_names:
+            field = self.fields[name]
+            value = np.zeros(headers.shape[0], dtype=np.uint64)
+            for byte_index in range(field.byte_start, field.byte_end):
+                value = (value << np.uint64(8)) | headers[:, byte_index]
+            value = (value >> np.uint64(field.shift)) & np.uint64(field.mask)
+            columns[name] = value.astype(self.field_dtype(name))
+        return columns
+
+
+    def __repr__(self) -> str:
+        return f'HeaderLayout({self.num_bytes} bytes, {len(self.fields)} fields)'
+
+
+PRIMARY_HEADER_LAYOUT   = HeaderLayout(PRIMARY_HEADER, PRIMARY_HEADER_FIELDS)
+SECONDARY_HEADER_LAYOUT = HeaderLayout(SECONDARY_HEADER, SECONDARY_HEADER_FIELDS)
+
+
+# Fields kept for each packet in the typed records made by Packet.to_record and decoding.scan_packet_headers.
+PACKET_RECORD_PRIMARY_FIELDS   = ['packet_sequence_count', 'packet_data_length']
+PACKET_RECORD_SECONDARY_FIELDS = [name for name in SECONDARY_HEADER_FIELDS if not name.startswith('na_')]
+PACKET_RECORD_DTYPE = np.dtype(
+    [('offset', np.int64)] +
+    [(name, PRIMARY_HEADER_LAYOUT.field_dtype(name)) for name in PACKET_RECORD_PRIMARY_FIELDS] +
+    [(name, SECONDARY_HEADER_LAYOUT.field_dtype(name)) for name in PACKET_RECORD_SECONDARY_FIELDS]
+)
@@ -1,48 +1,100 @@
+import logging
+
 import numpy as np
 
+from headers import (
+    PRIMARY_HEADER_LAYOUT,
+    SECONDARY_HEADER_LAYOUT,
+    PACKET_RECORD_DTYPE,
+    PACKET_RECORD_PRIMARY_FIELDS,
+    PACKET_RECORD_SECONDARY_FIELDS
+)
+
+from stats import DECODE_STATS
 from structs import (
-    BRC_TO_HUFFMAN_START_BIT_LEN, 
-    BRC_TO_HUFFMAN_CODING,
-    BRC_TO_HUFFMAN_CODING_SET,
     SECONDARY_HEADER_SIZE,
     WORD_SIZE,
-    SIMPLE_RECONSTRUCTION_METHOD,
-    NORMALIZED_RECONSTRUCTION_LEVELS,
-    THIDX_TO_SF_ARRAY,
-    BRC_TO_THIDX,
-    BRC_TO_M_CODE,
     ECC_CODE_TO_SENSOR_MODE,
     F_REF
 )
 
 from utils import (
-    create_bit_string,
-    read_and_pop,
-    huffman_decode
+    create_bit_windows,
+    create_bit_words,
+    read_bits,
+    read_word_bits,
+    read_bits_at,
+    read_bits_array,
+    huffman_decode_block,
+    huffman_decode_streams,
+    reconstruct_s_values,
+    TYPE_C_RECONSTRUCTION_TABLE,
+    TYPE_D_RECONSTRUCTION_TABLE,
+    TYPE_D_SIGNED_RECONSTRUCTION_TABLE
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 class Packet:
+    __slots__ = (
+        '__primary_header',
+        '__secondary_header',
+        '__primary_values',
+        '__secondary_values',
+        '__primary_header_dict',
+        '__secondary_header_dict',
+        '__num_quads',
+        '__test_mode',
+        '__baq_mode',
+        '__num_baq_blocks',
+        '__user_data_length',
+        '__raw_user_data',
+        '__data_format',
+        '__offset',
+    )
+
     def __init__(
         self,
         primary_header,
         secondary_header,
-        user_data_field
+        user_data_field,
+        offset: int = -1
     ):
+        # The raw header bytes are kept and only decoded (once) when a field is first needed.
         self.__primary_header   = primary_header
         self.__secondary_header = secondary_header
-
-        self.__num_quads      = int(secondary_header['num_quadratures'], 2)
-        self.__test_mode      = int(secondary_header['test_mode'], 2)
-        self.__baq_mode       = int(secondary_header['baq_mode'], 2)
+        self.__primary_values   = None
+        self.__secondary_values = None
+        self.__primary_header_dict   = None
+        self.__secondary_header_dict = None
+
+        self.__num_quads      = SECONDARY_HEADER_LAYOUT.decode_field(secondary_header, 'num_quadratures')
+        self.__test_mode      = SECONDARY_HEADER_LAYOUT.decode_field(secondary_header, 'test_mode')
+        self.__baq_mode       = SECONDARY_HEADER_LAYOUT.decode_field(secondary_header, 'baq_mode')
         self.__num_baq_blocks = int(np.ceil(2 * self.__num_quads / 256))
 
-        self.__user_data_length = (int(primary_header['packet_data_length'], 2) + 1) - SECONDARY_HEADER_SIZE
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(primary_header, 'packet_data_length')
+        self.__user_data_length = (packet_data_length + 1) - SECONDARY_HEADER_SIZE
         self.__raw_user_data = user_data_field
+        self.__offset = offset
 
         self.__set_data_format()
 
 
+    def __primary(self, field: str) -> int:
+        if self.__primary_values is None:
+            self.__primary_values = PRIMARY_HEADER_LAYOUT.decode_values(self.__primary_header)
+        return self.__primary_values[PRIMARY_HEADER_LAYOUT.field_index[field]]
+
+
+    def __secondary(self, field: str) -> int:
+        if self.__secondary_values is None:
+            self.__secondary_values = SECONDARY_HEADER_LAYOUT.decode_values(self.__secondary_header)
+        return self.__secondary_values[SECONDARY_HEADER_LAYOUT.field_index[field]]
+
+
     def num_quads(self) -> int:
         return self.__num_quads
 
@@ -67,28 +119,38 @@ class Packet:
         return self.__data_format
 
 
+    def signal_type(self) -> int:
+        return self.__secondary('signal_type')
+
+
+    def offset(self) -> int:
+        """Byte offset of the packet in its file, or -1 if it is not known."""
+        return self.__offset
+
+
     def get_tx_ramp_rate(self) -> np.float64:
-        bits = self.__secondary_header['tx_ramp_rate']
-        sign = -1 if bits[0] == '0' else 1
-        tx_pulse_ramp_rate = sign * int(bits[1:16], 2) * (np.power(F_REF, 2) / 2097152)  # 2^21
+        bits = self.__secondary('tx_ramp_rate')
+        sign = -1 if bits >> 15 == 0 else 1
+        tx_pulse_ramp_rate = sign * (bits & 0x7FFF) * (np.power(F_REF, 2) / 2097152)  # 2^21
         return tx_pulse_ramp_rate
 
 
-    def get_start_frequency(self) -> np.float64:
-        bits = self.__secondary_header['pulse_start_frequency']
-        sign = -1 if bits[0] == '0' else 1
-        txprr = self.get_tx_ramp_rate()
-        tx_start_frequency = (txprr / (4 * F_REF)) + sign * int(bits[1:16], 2) * (F_REF / 16384)  # 2^14
+    def get_start_frequency(self, txprr: np.float64 = None) -> np.float64:
+        bits = self.__secondary('pulse_start_frequency')
+        sign = -1 if bits >> 15 == 0 else 1
+        if txprr is None:
+            txprr = self.get_tx_ramp_rate()
+        tx_start_frequency = (txprr / (4 * F_REF)) + sign * (bits & 0x7FFF) * (F_REF / 16384)  # 2^14
         return tx_start_frequency
         
 
     def get_sensor_mode_str(self) -> str:
-        ecc_code = int(self.__secondary_header['ecc_number'], 2)
+        ecc_code = self.__secondary('ecc_number')
         return ECC_CODE_TO_SENSOR_MODE[ecc_code]
 
 
     def get_polarization_str(self) -> str:
-        pol_code = int(self.__secondary_header['polarisation'], 2)
+        pol_code = self.__secondary('polarisation')
         if 0 <= pol_code <= 3:
             return 'H'
         elif 4 <= pol_code <= 7:
@@ -99,18 +161,18 @@ class Packet:
 
     def get_test_mode_str(self) -> str:
         return {
-            '000': 'measurement_mode',
-            '001': 'n_a',
-            '011': 'n_a',
-            '100': 'contingency',
-            '101': 'contingency',
-            '110': 'test_mode_baq',
-            '111': 'test_mode_bypass',
-        }[self.__secondary_header['test_mode']]
+            0: 'measurement_mode',
+            1: 'n_a',
+            3: 'n_a',
+            4: 'contingency',
+            5: 'contingency',
+            6: 'test_mode_baq',
+            7: 'test_mode_bypass',
+        }[self.__secondary('test_mode')]
 
 
     def get_rx_channel_id_str(self) -> str:
-        rxchid_code = int(self.__secondary_header['rx_channel_id'], 2)
+        rxchid_code = self.__secondary('rx_channel_id')
         if rxchid_code == 0:
             return 'V'
         elif rxchid_code == 1:
@@ -146,7 +208,7 @@ class Packet:
             12: 'apdn_cal',
             15: 'txh_cal_iso'
         }
-        signal_type = int(self.__secondary_header['signal_type'], 2)
+        signal_type = self.__secondary('signal_type')
         try:
             return signal_types[signal_type]
         except KeyError:
@@ -154,293 +216,385 @@ class Packet:
 
 
     def get_sas_ssb(self):
-        ssb_flag = self.__secondary_header['ssb_flag']
-        if ssb_flag == '0':
+        ssb_flag = self.__secondary('ssb_flag')
+        if ssb_flag == 0:
             return {
                 'ssb_flag': 0,
                 'polarization': self.get_polarization_str(),
-                'temperature_compensation': int(self.__secondary_header['temperature_compensation'], 2),
-                'elevation_beam_address': int(self.__secondary_header['elevation_beam_address'], 2),
-                'azimuth_beam_address': int(self.__secondary_header['azimuth_beam_address'], 2),
+                'temperature_compensation': self.__secondary('temperature_compensation'),
+                'elevation_beam_address': self.__secondary('elevation_beam_address'),
+                'azimuth_beam_address': self.__secondary('azimuth_beam_address'),
             }
-        elif ssb_flag == '1':
+        elif ssb_flag == 1:
             return {
                 'ssb_flag': 1,
                 'polarization': self.get_polarization_str(),
-                'sas_test': 'test_mode' if self.__secondary_header['test_mode'] == '0' else 'normal',
-                # 'calibration_type': int(self.__secondary_header['calibration_mode'], 2),
-                # 'calibration_beam_address': int(self.__secondary_header['calibration_beam_address'], 2),
+                'sas_test': 'test_mode' if self.__secondary('test_mode') == 0 else 'normal',
+                # 'calibration_type': self.__secondary('calibration_mode'),
+                # 'calibration_beam_address': self.__secondary('calibration_beam_address'),
             }
         else:
             raise ValueError(f'SSB Flag is Invalid: {ssb_flag}')
 
 
     def get_primary_header(self) -> dict:
+        if self.__primary_header_dict is not None:
+            return self.__primary_header_dict.copy()
         primary_header = {
-            'packet_version_number': int(self.__primary_header['packet_version_number'], 2),
-            'packet_type': int(self.__primary_header['packet_type'], 2),
-            'secondary_header_flag': int(self.__primary_header['secondary_header_flag'], 2),
-            'process_id': int(self.__primary_header['process_id'], 2),
-            'process_category': int(self.__primary_header['process_category'], 2),
-            'packet_sequence_count': int(self.__primary_header['packet_sequence_count'], 2),
-            'packet_data_length': int(self.__primary_header['packet_data_length'], 2),
+            'packet_version_number': self.__primary('packet_version_number'),
+            'packet_type': self.__primary('packet_type'),
+            'secondary_header_flag': self.__primary('secondary_header_flag'),
+            'process_id': self.__primary('process_id'),
+            'process_category': self.__primary('process_category'),
+            'packet_sequence_count': self.__primary('packet_sequence_count'),
+            'packet_data_length': self.__primary('packet_data_length'),
         }
-        return primary_header
+        self.__primary_header_dict = primary_header
+        return primary_header.copy()
 
 
     def get_secondary_header(self) -> dict:
+        if self.__secondary_header_dict is not None:
+            return self.__secondary_header_dict.copy()
         # TODO: The SAS SSB field is not handled in the decoding code.
-        error_status = 'nominal' if int(self.__secondary_header['error_flag'], 2) == 0 else 'ssb corrupt'
+        tx_ramp_rate = self.get_tx_ramp_rate()
+        error_status = 'nominal' if self.__secondary('error_flag') == 0 else 'ssb corrupt'
         secondary_header = {
-            'coarse_time': int(self.__secondary_header['coarse_time'], 2),
-            'fine_time': int(self.__secondary_header['fine_time'], 2),
-            'sync_marker': int(self.__secondary_header['sync_marker'], 2),
-            'data_take_id': int(self.__secondary_header['data_take_id'], 2),
+            'coarse_time': self.__secondary('coarse_time'),
+            'fine_time': self.__secondary('fine_time'),
+            'sync_marker': self.__secondary('sync_marker'),
+            'data_take_id': self.__secondary('data_take_id'),
             'ecc': self.get_sensor_mode_str(),
             'test_mode': self.get_test_mode_str(),
             'rx_channel_id': self.get_rx_channel_id_str(),
-            'instrument_configuration_id': int(self.__secondary_header['instrument_configuration_id'], 2),
-            'sc_data_word_index': int(self.__secondary_header['sc_data_word_index'], 2),
-            'sc_data_word': self.__secondary_header['sc_data_word'],
-            'space_packet_count': int(self.__secondary_header['space_packet_count'], 2),
-            'pri_count': int(self.__secondary_header['pri_count'], 2),
+            'instrument_configuration_id': self.__secondary('instrument_configuration_id'),
+            'sc_data_word_index': self.__secondary('sc_data_word_index'),
+            'sc_data_word': format(self.__secondary('sc_data_word'), '016b'),
+            'space_packet_count': self.__secondary('space_packet_count'),
+            'pri_count': self.__secondary('pri_count'),
             'error_flag': error_status,
             'baq_mode': self.get_baq_mode_str(),
-            'baq_block_length': 8 * (int(self.__secondary_header['baq_block_length'], 2) + 1),
-            'range_decimation': int(self.__secondary_header['range_decimation'], 2),
-            'rx_gain': -0.5 * int(self.__secondary_header['rx_gain'], 2),
-            'tx_ramp_rate': self.get_tx_ramp_rate(),
-            'tx_pulse_start_frequency': self.get_start_frequency(),
-            'pulse_length': int(self.__secondary_header['pulse_length'], 2) / F_REF,
-            'rank': int(self.__secondary_header['rank'], 2),
-            'pri': int(self.__secondary_header['pri'], 2) / F_REF,
-            'swst': int(self.__secondary_header['swst'], 2) / F_REF,
-            'swl': int(self.__secondary_header['swl'], 2) / F_REF,
-            'calibration_mode': int(self.__secondary_header['calibration_mode'], 2),
-            'tx_pulse_number': int(self.__secondary_header['tx_pulse_number'], 2),
+            'baq_block_length': 8 * (self.__secondary('baq_block_length') + 1),
+            'range_decimation': self.__secondary('range_decimation'),
+            'rx_gain': -0.5 * self.__secondary('rx_gain'),
+            'tx_ramp_rate': tx_ramp_rate,
+            'tx_pulse_start_frequency': self.get_start_frequency(tx_ramp_rate),
+            'pulse_length': self.__secondary('pulse_length') / F_REF,
+            'rank': self.__secondary('rank'),
+            'pri': self.__secondary('pri') / F_REF,
+            'swst': self.__secondary('swst') / F_REF,
+            'swl': self.__secondary('swl') / F_REF,
+            'calibration_mode': self.__secondary('calibration_mode'),
+            'tx_pulse_number': self.__secondary('tx_pulse_number'),
             'signal_type': self.get_signal_type_str(),
-            'swap': int(self.__secondary_header['swap'], 2),
-            'swath_number': int(self.__secondary_header['swath_number'], 2),
+            'swap': self.__secondary('swap'),
+            'swath_number': self.__secondary('swath_number'),
             'num_quads': self.__num_quads
         }
         for k, v in self.get_sas_ssb().items():
             secondary_header[k] = v
-        return secondary_header
-
-    def get_complex_samples(self):
-        return self.__decode_user_data_field()
-
-
-    def __jump_to_next_word_boundary(self, bit_string, num_bits) -> tuple[str, int]:
-        offset = num_bits % WORD_SIZE
+        self.__secondary_header_dict = secondary_header
+        return secondary_header.copy()
+
+
+    def to_record(self) -> np.void:
+        """Returns the raw header fields as a compact typed record (see headers.PACKET_RECORD_DTYPE)."""
+        values = (
+            (self.__offset, ) +
+            tuple(self.__primary(field) for field in PACKET_RECORD_PRIMARY_FIELDS) +
+            tuple(self.__secondary(field) for field in PACKET_RECORD_SECONDARY_FIELDS)
+        )
+        return np.array(values, dtype=PACKET_RECORD_DTYPE)[()]
+
+
+    def get_complex_samples(self, out: np.ndarray = None):
+        """
+        Decodes the user data into complex samples, returning (samples, number of user data bytes decoded).
+        If out is given, the 2 * num_quads samples are written into its start (e.g. a row of a preallocated burst matrix,
+        in any complex dtype), and samples is a view of them.
+        If the user data cannot be decoded, a warning is logged, the failure is counted in DECODE_STATS, and None is returned.
+        """
+        if out is not None and out.shape[0] < 2 * self.__num_quads:
+            raise ValueError(f'Output has room for {out.shape[0]} samples, but the packet has {2 * self.__num_quads}.')
+        return self.__decode_user_data_field(out)
+
+
+    @staticmethod
+    def get_complex_samples_batch(packets: list, out: np.ndarray, batch_quads: int = 2**22) -> list:
+        """
+        Decodes packets[k] into out[k] for every k, as packets[k].get_complex_samples(out=out[k]) would, and returns
+        the number of user data bytes decoded per packet (None for packets that failed to decode).
+        Type D packets with the same number of quads are Huffman decoded together, one BAQ block of all of them
+        at a time (see huffman_decode_streams), which is many times faster than decoding them one by one.
+        Each of those batches holds at most about batch_quads quads, to bound the memory used.
+        """
+        num_bytes = [None] * len(packets)
+        type_d_groups = {}
+        for k, packet in enumerate(packets):
+            if packet.__data_format == 'D' and packet.__raw_user_data is not None:
+                type_d_groups.setdefault(packet.__num_quads, []).append(k)
+                continue
+            decoded = packet.get_complex_samples(out=out[k])
+            if decoded is not None:
+                num_bytes[k] = decoded[1]
+        batches = []
+        for num_quads, rows in type_d_groups.items():
+            if out.shape[1] < 2 * num_quads:
+                raise ValueError(f'Output has room for {out.shape[1]} samples, but the packets have {2 * num_quads}.')
+            batch_size = max(1, batch_quads // max(1, num_quads))
+            batches.extend(rows[i:i + batch_size] for i in range(0, len(rows), batch_size))
+        for rows in batches:
+            group_bytes = Packet.__decode_type_d_batch([packets[k] for k in rows], out, np.asarray(rows))
+            for k, packet_bytes in zip(rows, group_bytes):
+                if packet_bytes is None:
+                    # Decoded on its own, so that it fails (or not) exactly as it would outside of a batch.
+                    decoded = packets[k].get_complex_samples(out=out[k])
+                    packet_bytes = None if decoded is None else decoded[1]
+                num_bytes[k] = packet_bytes
+        return num_bytes
+
+
+    def __get_output(self, out: np.ndarray) -> np.ndarray:
+        if out is None:
+            return np.zeros((2 * self.__num_quads, ), dtype=complex)
+        return out[:2 * self.__num_quads]
+
+
+    def __next_word_boundary(self, bit_index: int) -> int:
+        offset = bit_index % WORD_SIZE
         if offset == 0:
-            return bit_string, offset
-        next_word_boundary = WORD_SIZE - offset
-        _, bit_string = read_and_pop(bit_string, next_word_boundary)
-        return bit_string, next_word_boundary
+            return bit_index
+        return bit_index + (WORD_SIZE - offset)
 
 
-    def __get_type_d_signs_and_m_codes(
-        self,
-        bit_string: str,
-        brc: int,
-        last_block: bool
-    ) -> tuple[list[int], list[int], str, int]:
-        signs = []
-        m_codes = []
-        total_bits = 0
-        num_s_codes = 128 if not last_block else self.__num_quads - (128 * (self.__num_baq_blocks - 1))
-        for _ in range(num_s_codes):
-            sign, bit_string = read_and_pop(bit_string, 1)
-            m_code, bit_string, bit_len = huffman_decode(
-                bit_string,
-                BRC_TO_HUFFMAN_START_BIT_LEN[brc],
-                BRC_TO_HUFFMAN_CODING_SET[brc],
-                BRC_TO_HUFFMAN_CODING[brc]
-            )
-            signs.append(int(sign, 2))
-            m_codes.append(m_code)
-            total_bits += (bit_len + 1)
-        return signs, m_codes, bit_string, total_bits
-
-
-    def __type_d_decoder(self, bit_string, component: str) -> tuple[str, int]:
+    def __type_d_decoder(self, windows, bit_index: int, component: str, brcs: list, thresholds: list) -> tuple[list, list, int]:
         brc_size = 3
         threshold_size = 8
-        num_bits = 0
-        total_bits = 0
-        component_signs, component_m_codes = self.component_dict[component]
+        component_signs = []
+        component_m_codes = []
         for i in range(self.__num_baq_blocks):
             if component == 'IE':
-                brc, bit_string = read_and_pop(bit_string, brc_size)
-                brc = int(brc, 2)
+                brc = read_bits(windows, bit_index, brc_size)
+                bit_index += brc_size
                 if brc > 4:
                     raise ValueError(f'Invalid BRC: {brc} at {i}')
-                self.__brc.append(brc)
+                brcs.append(brc)
             if component == 'QE':
-                threshold, bit_string = read_and_pop(bit_string, threshold_size)
-                self.__thresholds.append([int(threshold, 2)])
-            brc = self.__brc[i]
+                threshold = read_bits(windows, bit_index, threshold_size)
+                bit_index += threshold_size
+                thresholds.append(threshold)
             last_block = i == self.__num_baq_blocks - 1
-            signs, m_codes, bit_string, num_bits = self.__get_type_d_signs_and_m_codes(
-                bit_string,
-                self.__brc[i],
-                last_block
-            )
+            num_s_codes = 128 if not last_block else self.__num_quads - (128 * (self.__num_baq_blocks - 1))
+            signs, m_codes, bit_index = huffman_decode_block(windows, bit_index, brcs[i], num_s_codes)
             component_signs.append(signs)
             component_m_codes.append(m_codes)
-            brc_offset = brc_size if component == 'IE' else 0
-            threshold_offset = threshold_size if component == 'QE' else 0
-            total_bits += num_bits + brc_offset + threshold_offset
-        bit_string, offset = self.__jump_to_next_word_boundary(bit_string, total_bits)
-        return bit_string, total_bits + offset
-
-
-    def __get_type_d_s_value(self, brc, threshold_index, m_code, sign) -> np.float64:
-        thidx_comp_flag = BRC_TO_THIDX[brc]
-        m_code_comp_flag = BRC_TO_M_CODE[brc]
-        if threshold_index <= thidx_comp_flag:
-            if m_code < m_code_comp_flag:
-                return np.power(-1, sign) * m_code
-            elif m_code == m_code_comp_flag:
-                simple_recon = SIMPLE_RECONSTRUCTION_METHOD[1][brc][threshold_index]
-                return np.power(-1, sign) * simple_recon
-            else:
-                raise ValueError(f'm_code not valid: {m_code}')
-        elif threshold_index > thidx_comp_flag:
-            normal_recon = NORMALIZED_RECONSTRUCTION_LEVELS[1][brc][m_code]
-            sigma_factor = THIDX_TO_SF_ARRAY[threshold_index]
-            return np.power(-1, sign) * normal_recon * sigma_factor
-
-
-    def __type_d_s_value_reconstruction(self) -> None:
-        s_values = []
-        for block_id in range(self.__num_baq_blocks):
-            brc = self.__brc[block_id]
-            threshold_index = self.__thresholds[block_id][0]
-            block_len = len(self.__ie_m_codes[block_id])
-            for s_code_id in range(block_len):
-                ie_sign, ie_m_code = self.__ie_signs[block_id][s_code_id], self.__ie_m_codes[block_id][s_code_id]
-                io_sign, io_m_code = self.__io_signs[block_id][s_code_id], self.__io_m_codes[block_id][s_code_id]
-                qe_sign, qe_m_code = self.__qe_signs[block_id][s_code_id], self.__qe_m_codes[block_id][s_code_id]
-                qo_sign, qo_m_code = self.__qo_signs[block_id][s_code_id], self.__qo_m_codes[block_id][s_code_id]
-                ie_s_value = self.__get_type_d_s_value(brc, threshold_index, ie_m_code, ie_sign)
-                io_s_value = self.__get_type_d_s_value(brc, threshold_index, io_m_code, io_sign)
-                qe_s_value = self.__get_type_d_s_value(brc, threshold_index, qe_m_code, qe_sign)
-                qo_s_value = self.__get_type_d_s_value(brc, threshold_index, qo_m_code, qo_sign)
-                component_s_values = [ie_s_value, io_s_value, qe_s_value, qo_s_value]
-                s_values.append(component_s_values)
-        complex_s_values = np.zeros((2 * self.__num_quads, ), dtype=complex)
-        for i in range(1, self.__num_quads+1):
-            ie, io, qe, qo = tuple(s_values[i-1])
-            complex_s_values[2*i-2] = ie + 1j*qe
-            complex_s_values[2*i-1] = io + 1j*qo
+        return component_signs, component_m_codes, self.__next_word_boundary(bit_index)
+
+
+    def __type_d_s_value_reconstruction(self, components: list, brcs: list, thresholds: list, out: np.ndarray) -> np.ndarray:
+        block_lengths = [len(m_codes) for m_codes in components[0][1]]
+        brc = np.repeat(brcs, block_lengths)
+        thresholds = np.repeat(thresholds, block_lengths)
+        get_s_values = lambda signs, m_codes: reconstruct_s_values(
+            TYPE_D_RECONSTRUCTION_TABLE,
+            brc,
+            thresholds,
+            np.concatenate(signs),
+            np.concatenate(m_codes)
+        )
+        ie, io, qe, qo = components
+        complex_s_values = self.__get_output(out)
+        complex_s_values.real[0::2] = get_s_values(*ie)
+        complex_s_values.real[1::2] = get_s_values(*io)
+        complex_s_values.imag[0::2] = get_s_values(*qe)
+        complex_s_values.imag[1::2] = get_s_values(*qo)
         return complex_s_values
 
 
-    def __decode_type_d_data(self) -> None:
-        self.__brc        = []
-        self.__thresholds = []
-        bit_counts = [0, 0, 0, 0]
-        bit_string = create_bit_string(self.__raw_user_data)
-        bit_string, bit_counts[0] = self.__type_d_decoder(bit_string, 'IE')
-        bit_string, bit_counts[1] = self.__type_d_decoder(bit_string, 'IO')
-        bit_string, bit_counts[2] = self.__type_d_decoder(bit_string, 'QE')
-        bit_string, bit_counts[3] = self.__type_d_decoder(bit_string, 'QO')
-        complex_s_values = self.__type_d_s_value_reconstruction()
-        num_bytes = sum(bit_counts) / 8
+    def __decode_type_d_data(self, out: np.ndarray) -> None:
+        brcs       = []
+        thresholds = []
+        components = []
+        start_time = DECODE_STATS.start()
+        windows = create_bit_windows(self.__raw_user_data)
+        bit_index = 0
+        for component in ['IE', 'IO', 'QE', 'QO']:
+            signs, m_codes, bit_index = self.__type_d_decoder(windows, bit_index, component, brcs, thresholds)
+            components.append((signs, m_codes))
+        DECODE_STATS.stop('huffman', start_time)
+        start_time = DECODE_STATS.start()
+        complex_s_values = self.__type_d_s_value_reconstruction(components, brcs, thresholds, out)
+        DECODE_STATS.stop('reconstruction', start_time)
+        num_bytes = bit_index / 8
         self.__raw_user_data = None
-        self.__delete_codes()
-        del self.__brc
-        del self.__thresholds
         return complex_s_values, num_bytes
 
 
-    def __type_a_b_s_value_reconstruction(self) -> None:
+    @staticmethod
+    def __decode_type_d_batch(packets: list, out: np.ndarray, rows: np.ndarray) -> list:
+        """
+        Decodes Type D packets that all have the same number of quads into out[rows]. Returns the number of user
+        data bytes decoded per packet, or None for packets with an invalid BRC, m_code, or too little user data.
+        """
+        brc_size = 3
+        threshold_size = 8
+        num_quads = packets[0].__num_quads
+        num_baq_blocks = packets[0].__num_baq_blocks
+        block_lengths = np.full(num_baq_blocks, 128)
+        block_lengths[-1] = num_quads - 128 * (num_baq_blocks - 1)
+        start_time = DECODE_STATS.start()
+        # Each packet starts on a 4 byte boundary, so that its word boundaries are those of the batch.
+        lengths = np.array([len(packet.__raw_user_data) for packet in packets], dtype=np.int64)
+        starts = np.zeros(len(packets), dtype=np.int64)
+        np.cumsum((lengths[:-1] + 3) & ~3, out=starts[1:])
+        data = np.zeros(int(starts[-1] + lengths[-1]), dtype=np.uint8)
+        for start, length, packet in zip(starts, lengths, packets):
+            data[start:start + length] = np.frombuffer(packet.__raw_user_data, dtype=np.uint8)
+        # The padding keeps a block that runs past the end of the last packet in bounds.
+        words = create_bit_words(data, padding=256)
+        first_bits = 8 * starts
+        end_bits = 8 * (starts + lengths)
+        bit_indices = first_bits.copy()
+        failed = np.zeros(len(packets), dtype=bool)
+        brcs = np.zeros((len(packets), num_baq_blocks), dtype=np.uint8)
+        thresholds = np.zeros((len(packets), num_baq_blocks), dtype=np.uint8)
+        # Codes are kept per quad in IE, QE, IO, QO order, which is the order of the s_values in the complex output.
+        codes = np.empty((len(packets), num_quads, 4), dtype=np.uint8)
+        for component, channel in zip(['IE', 'IO', 'QE', 'QO'], [0, 2, 1, 3]):
+            block_start = 0
+            for i, block_length in enumerate(block_lengths):
+                if component == 'IE':
+                    brcs[:, i] = read_word_bits(words, bit_indices, brc_size)
+                    bit_indices += brc_size
+                    failed |= brcs[:, i] > 4
+                    brcs[failed, i] = 0
+                if component == 'QE':
+                    thresholds[:, i] = read_word_bits(words, bit_indices, threshold_size)
+                    bit_indices += threshold_size
+                codes[:, block_start:block_start + block_length, channel], bit_indices = huffman_decode_streams(
+                    words,
+                    bit_indices,
+                    brcs[:, i],
+                    block_length
+                )
+                block_start += block_length
+                # Packets that ran out of user data are restarted, so that none of them runs away.
+                failed |= bit_indices > end_bits
+                bit_indices[failed] = first_bits[failed]
+            bit_indices += -bit_indices % WORD_SIZE
+        DECODE_STATS.stop('huffman', start_time)
+        start_time = DECODE_STATS.start()
+        # Row of TYPE_D_SIGNED_RECONSTRUCTION_TABLE for each block, from its BRC and threshold index.
+        table_rows = 256 * (256 * brcs.astype(np.int32) + thresholds)
+        # A few hundred thousand quads at a time, so that the s_values stay in cache until they are copied to out.
+        chunk_size = max(1, 2**18 // max(1, num_quads))
+        for chunk in range(0, len(packets), chunk_size):
+            chunk_rows = np.repeat(table_rows[chunk:chunk + chunk_size], block_lengths, axis=1)
+            s_values = TYPE_D_SIGNED_RECONSTRUCTION_TABLE[chunk_rows[:, :, None] + codes[chunk:chunk + chunk_size]]
+            chunk_failed = failed[chunk:chunk + chunk_size]
+            chunk_failed |= np.isnan(s_values).any(axis=(1, 2))
+            complex_s_values = s_values.view(np.complex128).reshape(len(s_values), 2 * num_quads)
+            if chunk_failed.any():
+                out[rows[chunk:chunk + chunk_size][~chunk_failed], :2 * num_quads] = complex_s_values[~chunk_failed]
+            else:
+                out[rows[chunk:chunk + chunk_size], :2 * num_quads] = complex_s_values
+        DECODE_STATS.stop('reconstruction', start_time)
+        num_bytes = (bit_indices - first_bits) / 8
+        for packet, packet_failed in zip(packets, failed):
+            if not packet_failed:
+                packet.__raw_user_data = None
+                if DECODE_STATS.enabled:
+                    DECODE_STATS.add_packet('D', packet.__user_data_length)
+        return [None if packet_failed else packet_bytes for packet_bytes, packet_failed in zip(num_bytes.tolist(), failed)]
+
+
+    def __decode_type_a_b_data(self, out: np.ndarray) -> None:
+        sign_bits = 1
+        m_code_bits = 9
+        sample_bits = sign_bits + m_code_bits
+        start_time = DECODE_STATS.start()
+        bit_index = 0
         s_values = []
-        num_s_codes = len(self.__ie_signs)
-        construct_s_value = lambda sign, m_code: np.power(-1, sign) * m_code
-        for i in range(num_s_codes):
-            ie_s_value = construct_s_value(self.__ie_signs[i], self.__ie_m_codes[i])
-            io_s_value = construct_s_value(self.__io_signs[i], self.__io_m_codes[i])
-            qe_s_value = construct_s_value(self.__qe_signs[i], self.__qe_m_codes[i])
-            qo_s_value = construct_s_value(self.__qo_signs[i], self.__qo_m_codes[i])
-            s_values.append([ie_s_value, io_s_value, qe_s_value, qo_s_value])
-        complex_s_values = np.zeros((2 * len(s_values), ), dtype=complex)
-        for i in range(1, self.__num_quads+1):
-            ie, io, qe, qo = tuple(s_values[i-1])
-            complex_s_values[2*i-2] = ie + 1j*qe
-            complex_s_values[2*i-1] = io + 1j*qo
-        return complex_s_values
+        for _ in range(4):  # IE, IO, QE, QO
+            samples = read_bits_array(self.__raw_user_data, bit_index, self.__num_quads, sample_bits)
+            m_codes = (samples & ((1 << m_code_bits) - 1)).astype(np.float64)
+            s_values.append(np.where(samples >> m_code_bits, -m_codes, m_codes))
+            bit_index = self.__next_word_boundary(bit_index + self.__num_quads * sample_bits)
+        ie, io, qe, qo = s_values
+        complex_s_values = self.__get_output(out)
+        complex_s_values.real[0::2] = ie
+        complex_s_values.real[1::2] = io
+        complex_s_values.imag[0::2] = qe
+        complex_s_values.imag[1::2] = qo
+        DECODE_STATS.stop('sample_unpacking', start_time)
+        num_bytes = bit_index / 8
+        self.__raw_user_data = None
+        return complex_s_values, num_bytes
 
 
-    def __type_a_b_decoder(self, bit_string, component) -> tuple[str, int]:
-        num_bits = 0
-        sign_bits = 1
-        m_code_bits = 9
-        component_signs, component_m_codes = self.component_dict[component]
-        for _ in range(self.__num_quads):
-            sign, bit_string = read_and_pop(bit_string, sign_bits)
-            m_code, bit_string = read_and_pop(bit_string, m_code_bits)
-            component_signs.append(int(sign, 2))
-            component_m_codes.append(int(m_code, 2))
-            num_bits += 10
-        bit_string, offset = self.__jump_to_next_word_boundary(bit_string, num_bits)
-        return bit_string, num_bits + offset
-
-
-    def __decode_type_a_b_data(self) -> None:
-        bit_string = create_bit_string(self.__raw_user_data)
-        bit_counts = [0, 0, 0, 0]
-        bit_string, bit_counts[0] = self.__type_a_b_decoder(bit_string, 'IE')
-        bit_string, bit_counts[1] = self.__type_a_b_decoder(bit_string, 'IO')
-        bit_string, bit_counts[2] = self.__type_a_b_decoder(bit_string, 'QE')
-        bit_string, bit_counts[3] = self.__type_a_b_decoder(bit_string, 'QO')
-        complex_s_values = self.__type_a_b_s_value_reconstruction()
-        num_bytes = sum(bit_counts) / 8
+    def __decode_type_c_data(self, out: np.ndarray) -> None:
+        threshold_size = 8
+        sample_bits = self.__baq_mode  # Sign bit + (BAQ mode - 1) bit m_code.
+        m_code_bits = sample_bits - 1
+        block_size = 128
+        block_bits = threshold_size + block_size * sample_bits
+        sample_ids = np.arange(self.__num_quads, dtype=np.int64)
+        block_ids = sample_ids // block_size
+        start_time = DECODE_STATS.start()
+        bit_index = 0
+        samples = []
+        for component in ['IE', 'IO', 'QE', 'QO']:
+            if component == 'QE':
+                block_starts = bit_index + block_bits * np.arange(self.__num_baq_blocks, dtype=np.int64)
+                thresholds = read_bits_at(self.__raw_user_data, block_starts, threshold_size)
+                sample_starts = block_starts[block_ids] + threshold_size + sample_bits * (sample_ids % block_size)
+                samples.append(read_bits_at(self.__raw_user_data, sample_starts, sample_bits))
+                bit_index += self.__num_baq_blocks * threshold_size
+            else:
+                samples.append(read_bits_array(self.__raw_user_data, bit_index, self.__num_quads, sample_bits))
+            bit_index = self.__next_word_boundary(bit_index + self.__num_quads * sample_bits)
+        thresholds = thresholds[block_ids]
+        DECODE_STATS.stop('sample_unpacking', start_time)
+        start_time = DECODE_STATS.start()
+        get_s_values = lambda codes: reconstruct_s_values(
+            TYPE_C_RECONSTRUCTION_TABLE,
+            self.__baq_mode - 3,
+            thresholds,
+            codes >> m_code_bits,
+            codes & ((1 << m_code_bits) - 1)
+        )
+        ie, io, qe, qo = samples
+        complex_s_values = self.__get_output(out)
+        complex_s_values.real[0::2] = get_s_values(ie)
+        complex_s_values.real[1::2] = get_s_values(io)
+        complex_s_values.imag[0::2] = get_s_values(qe)
+        complex_s_values.imag[1::2] = get_s_values(qo)
+        DECODE_STATS.stop('reconstruction', start_time)
+        num_bytes = bit_index / 8
         self.__raw_user_data = None
-        self.__delete_codes()
-        del self.__raw_user_data
         return complex_s_values, num_bytes
 
 
-    def __delete_codes(self):
-        del self.__ie_signs
-        del self.__ie_m_codes
-        del self.__io_signs
-        del self.__io_m_codes
-        del self.__qe_signs
-        del self.__qe_m_codes
-        del self.__qo_signs
-        del self.__qo_m_codes
-
-
-    def __decode_user_data_field(self) -> None:
-        self.__ie_signs, self.__ie_m_codes  = [], []
-        self.__io_signs, self.__io_m_codes  = [], []
-        self.__qe_signs, self.__qe_m_codes  = [], []
-        self.__qo_signs, self.__qo_m_codes  = [], []
-        self.component_dict = {
-            'IE': (self.__ie_signs, self.__ie_m_codes),
-            'IO': (self.__io_signs, self.__io_m_codes),
-            'QE': (self.__qe_signs, self.__qe_m_codes),
-            'QO': (self.__qo_signs, self.__qo_m_codes)
-        }
+    def __decode_user_data_field(self, out: np.ndarray = None) -> None:
         try:
             if self.__data_format == 'A':
-                return self.__decode_type_a_b_data()
+                decoded = self.__decode_type_a_b_data(out)
             elif self.__data_format == 'B':
-                return self.__decode_type_a_b_data()
+                decoded = self.__decode_type_a_b_data(out)
             elif self.__data_format == 'C':
-                # Type C is not (forseen to be) used in nominal operation.
-                # This will not be supported until I come across it.
-                raise NotImplementedError("Data Format C is not supported.")
+                decoded = self.__decode_type_c_data(out)
             elif self.__data_format == 'D':
-                return self.__decode_type_d_data()
+                decoded = self.__decode_type_d_data(out)
             else:
                 raise ValueError('Packet does not have a valid data format.')
         except Exception as e:
-            print(f"Error encountered with data format, skipping user data decoding: {e}")
+            logger.warning('Skipping user data decoding of the packet at byte offset %d: %s', self.__offset, e)
+            if DECODE_STATS.enabled:
+                DECODE_STATS.add_packet(self.__data_format, self.__user_data_length, failed=True)
+            return None
+        if DECODE_STATS.enabled:
+            DECODE_STATS.add_packet(self.__data_format, self.__user_data_length)
+        return decoded
 
 
     def __set_data_format(self) -> None:
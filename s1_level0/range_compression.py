@@ -0,0 +1,94 @@
+"""
+By: Andrew Player
+Description: Streaming range compression of echo packets.
+             Each line is compressed as it comes off a packet generator, against a matched filter built from the packet's
+             own chirp parameters. Filters are cached per parameter set, so only one line (plus the cache) is held in memory
+             instead of a raw and a compressed burst.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.fft import fft, ifft, next_fast_len
+
+from bursts import ECHO_SIGNAL_TYPE
+from structs import RANGE_DECIMATION_TO_SAMPLE_RATE
+
+
+def get_replica_chirp(tx_ramp_rate: float, tx_pulse_start_frequency: float, pulse_length: float, range_decimation: int) -> np.ndarray:
+    """
+    Returns the sampled transmit chirp (units as in Packet.get_secondary_header: MHz/us, MHz, and us),
+    with the same sampling and scaling as the replica in level_1.ipynb.
+    """
+    num_replica_samples = int(np.floor(RANGE_DECIMATION_TO_SAMPLE_RATE[range_decimation] * pulse_length))
+    t = np.linspace(0.0, pulse_length, num_replica_samples)
+    phase = tx_pulse_start_frequency * t + (tx_ramp_rate / 2) * t**2
+    return (1 / num_replica_samples) * np.exp(2j * np.pi * phase)
+
+
+@lru_cache(maxsize=64)
+def get_matched_filter(
+    tx_ramp_rate: float,
+    tx_pulse_start_frequency: float,
+    pulse_length: float,
+    range_decimation: int,
+    num_samples: int,
+    dtype=np.complex64
+) -> np.ndarray:
+    """
+    Returns the matched filter spectrum for lines of num_samples samples, of length next_fast_len(num_samples + replica length).
+    The replica is circularly shifted so that the first num_samples outputs line up with those of
+    ifftshift(ifft(pulse_compression(...))) in level_1.ipynb, but without its wrap-around at the line edges.
+    """
+    replica = get_replica_chirp(tx_ramp_rate, tx_pulse_start_frequency, pulse_length, range_decimation)
+    num_replica_samples = replica.shape[0]
+    fft_size = next_fast_len(num_samples + num_replica_samples)
+    replica_start = int(np.ceil((num_samples - num_replica_samples) / 2)) - 1
+    delay = (num_samples - num_samples // 2 - replica_start) % num_samples
+    padded_replica = np.zeros(fft_size, dtype=complex)
+    padded_replica[:num_replica_samples] = replica
+    matched_filter = np.conj(fft(np.roll(padded_replica, -delay))).astype(dtype)
+    matched_filter.flags.writeable = False
+    return matched_filter
+
+
+def range_compress_line(
+    samples: np.ndarray,
+    tx_ramp_rate: float,
+    tx_pulse_start_frequency: float,
+    pulse_length: float,
+    range_decimation: int
+) -> np.ndarray:
+    """Range compresses a single line of complex samples, returning a new line of the same length and dtype."""
+    num_samples = samples.shape[0]
+    matched_filter = get_matched_filter(
+        tx_ramp_rate, tx_pulse_start_frequency, pulse_length, range_decimation, num_samples, samples.dtype
+    )
+    spectrum = fft(samples, n=matched_filter.shape[0])
+    spectrum *= matched_filter
+    return ifft(spectrum, overwrite_x=True)[:num_samples].copy()
+
+
+def range_compression_generator(packets, signal_type: int = ECHO_SIGNAL_TYPE, dtype=np.complex64):
+    """
+    Pipeline stage that takes packets (e.g. from decoding.packet_generator) and yields (packet, range compressed line)
+    for each packet of signal_type (every packet if it is None). Packets that fail to decode are skipped.
+    """
+    line = np.zeros(0, dtype=dtype)
+    for packet in packets:
+        if signal_type is not None and packet.signal_type() != signal_type:
+            continue
+        num_samples = 2 * packet.num_quads()
+        if line.shape[0] < num_samples:
+            line = np.zeros(num_samples, dtype=dtype)
+        decoded = packet.get_complex_samples(out=line)
+        if decoded is None:
+            continue
+        secondary_header = packet.get_secondary_header()
+        yield packet, range_compress_line(
+            line[:num_samples],
+            secondary_header['tx_ramp_rate'],
+            secondary_header['tx_pulse_start_frequency'],
+            secondary_header['pulse_length'],
+            secondary_header['range_decimation']
+        )
@@ -0,0 +1,116 @@
+"""
+By: Andrew Player
+Description: Background read-ahead for packet streams.
+             A reader thread fills a bounded queue with large chunks of the file, each cut at a packet boundary,
+             while the consumer decodes the packets of the previous chunks, so that I/O latency (e.g. on network storage)
+             overlaps with decoding instead of alternating with it.
+"""
+
+import os
+import queue
+import threading
+
+from decoding import buffer_packet_generator
+from headers import PRIMARY_HEADER_LAYOUT
+from stats import DECODE_STATS
+from structs import PRIMARY_HEADER_SIZE
+
+
+def last_packet_boundary(data) -> int:
+    """Returns the end of the last complete packet in data, which starts at a packet boundary."""
+    data = memoryview(data)
+    offset = 0
+    while offset + PRIMARY_HEADER_SIZE <= len(data):
+        packet_data_length = PRIMARY_HEADER_LAYOUT.decode_field(data[offset:offset + PRIMARY_HEADER_SIZE], 'packet_data_length')
+        packet_end = offset + PRIMARY_HEADER_SIZE + packet_data_length + 1
+        if packet_end > len(data):
+            break
+        offset = packet_end
+    return offset
+
+
+class ChunkReader(threading.Thread):
+    """Reads packet-aligned chunks of (about) chunk_size bytes into a queue of at most queue_depth chunks."""
+
+    END = object()
+
+    def __init__(self, raw_data, chunk_size: int, queue_depth: int):
+        super().__init__(daemon=True)
+        self.raw_data = raw_data
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=queue_depth)
+        self.stopped = threading.Event()
+
+
+    def put(self, item) -> bool:
+        """Waits for room in the queue, returning False (without queueing item) if the reader was stopped meanwhile."""
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+    def run(self) -> None:
+        try:
+            if isinstance(self.raw_data, (str, os.PathLike)):
+                with open(self.raw_data, 'rb') as raw_data:
+                    self.read_chunks(raw_data)
+            else:
+                self.read_chunks(self.raw_data)
+        except Exception as e:
+            self.put(e)
+        self.put(self.END)
+
+
+    def read_chunks(self, raw_data) -> None:
+        pending = b''
+        chunk_offset = 0
+        while not self.stopped.is_set():
+            start_time = DECODE_STATS.start()
+            data = raw_data.read(self.chunk_size)
+            DECODE_STATS.stop('io', start_time)
+            if not data:
+                break
+            data = pending + data
+            boundary = last_packet_boundary(data)
+            if boundary > 0 and not self.put((chunk_offset, data[:boundary])):
+                return
+            chunk_offset += boundary
+            pending = data[boundary:]
+        if pending:  # A truncated last packet, which buffer_packet_generator reports.
+            self.put((chunk_offset, pending))
+
+
+    def stop(self) -> None:
+        self.stopped.set()
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+        self.join()
+
+
+def read_ahead_packet_generator(raw_data, chunk_size: int = 2**24, queue_depth: int = 4, header_filter=None):
+    """
+    Yields the packets of raw_data (a filename or an open file), read by a background thread in chunks of about chunk_size
+    bytes with up to queue_depth chunks buffered ahead of the consumer. Packets get their offsets in the file, and
+    header_filter works as in packet_generator. Like packet_generator, it stops at the end of the file, and raises
+    ValueError on a truncated last packet. Closing the generator (or leaving a loop over it) stops the thread.
+    """
+    reader = ChunkReader(raw_data, chunk_size, queue_depth)
+    reader.start()
+    try:
+        while True:
+            item = reader.chunks.get()
+            if item is ChunkReader.END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            chunk_offset, chunk = item
+            yield from buffer_packet_generator(chunk, 0, header_filter, chunk_offset)
+    finally:
+        reader.stop()
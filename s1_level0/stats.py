@@ -0,0 +1,123 @@
+"""
+By: Andrew Player
+Description: Instrumentation for the Level-0 decoders.
+             DECODE_STATS counts packets, bytes, and failed decodes per data format, and accumulates the time spent
+             in each decoding stage (I/O, header parsing, Huffman decoding, reconstruction, ...). It is off by default,
+             in which case each instrumented stage only costs a couple of no-op calls. A callback can be set to export the
+             stats to a metrics system every so many packets.
+
+             Stages are timed with start/stop:
+                 start_time = DECODE_STATS.start()
+                 ...
+                 DECODE_STATS.stop('huffman', start_time)
+
+             Example:
+                 DECODE_STATS.enable()
+                 DECODE_STATS.set_callback(lambda snapshot: print(snapshot['stage_seconds']), interval=10000)
+                 ...decode...
+                 print(DECODE_STATS.snapshot())
+"""
+
+import threading
+import time
+
+from collections import defaultdict
+
+
+class DecodeStats:
+    def __init__(self):
+        self.enabled = False
+        self.__lock = threading.Lock()
+        self.__callback = None
+        self.__callback_interval = 0
+        self.__next_callback = 0
+        self.reset()
+
+
+    def enable(self) -> None:
+        self.enabled = True
+
+
+    def disable(self) -> None:
+        self.enabled = False
+
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__packets = defaultdict(int)
+            self.__bytes = defaultdict(int)
+            self.__failures = defaultdict(int)
+            self.__stage_seconds = defaultdict(float)
+            self.__stage_calls = defaultdict(int)
+            self.__started = time.time()
+            self.__next_callback = self.__callback_interval
+
+
+    def set_callback(self, callback, interval: int = 1000) -> None:
+        """Calls callback(snapshot) after every interval decoded (or failed) packets. callback=None removes it."""
+        with self.__lock:
+            self.__callback = callback
+            self.__callback_interval = interval
+            self.__next_callback = sum(self.__packets.values()) + sum(self.__failures.values()) + interval
+
+
+    def start(self):
+        """Returns the start time of a stage to pass to stop, or None if stats are disabled."""
+        return time.perf_counter() if self.enabled else None
+
+
+    def stop(self, stage: str, start_time) -> None:
+        if start_time is not None:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self.__lock:
+            self.__stage_seconds[stage] += seconds
+            self.__stage_calls[stage] += 1
+
+
+    def add_packet(self, data_format: str, num_bytes: int, failed: bool = False) -> None:
+        with self.__lock:
+            if failed:
+                self.__failures[data_format] += 1
+            else:
+                self.__packets[data_format] += 1
+                self.__bytes[data_format] += num_bytes
+            total = sum(self.__packets.values()) + sum(self.__failures.values())
+            callback = self.__callback if self.__callback is not None and total >= self.__next_callback else None
+            if callback is not None:
+                self.__next_callback = total + self.__callback_interval
+        if callback is not None:
+            callback(self.snapshot())
+
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the current stats, as plain dicts of per data format counts and per stage times."""
+        with self.__lock:
+            return {
+                'packets': dict(self.__packets),
+                'bytes': dict(self.__bytes),
+                'failures': dict(self.__failures),
+                'stage_seconds': dict(self.__stage_seconds),
+                'stage_calls': dict(self.__stage_calls),
+                'elapsed_seconds': time.time() - self.__started,
+            }
+
+
+    def export(self) -> None:
+        """Calls the callback (if any) with the current stats right away."""
+        if self.__callback is not None:
+            self.__callback(self.snapshot())
+
+
+    def __repr__(self) -> str:
+        snapshot = self.snapshot()
+        stages = ', '.join(f'{stage}: {seconds:.3f}s' for stage, seconds in snapshot['stage_seconds'].items())
+        return (
+            f"DecodeStats(packets={snapshot['packets']}, bytes={snapshot['bytes']}, "
+            f"failures={snapshot['failures']}, stages={{{stages}}})"
+        )
+
+
+DECODE_STATS = DecodeStats()
@@ -18,6 +18,8 @@ SECONDARY_HEADER_SIZE = 62
 WORD_SIZE = 16
 # Hertz
 F_REF = 37.53472224
+# Fixed value of the secondary header Sync Marker, Table 3.2-2 from Page 16
+SYNC_MARKER = 0x352EF853
 
 # Table 2.4-1 from Page 13
 PRIMARY_HEADER = [
@@ -531,6 +533,7 @@ BRC_INT_TO_HUFFMAN_CODING = [
 
 # Table 5.2-1 from Page 78
 BRC_TO_THIDX  = [3, 3, 5, 6,  8]
+BAQ_MODE_TO_THIDX = {3: 3, 4: 5, 5: 10}
 SIMPLE_RECONSTRUCTION_METHOD = [
     [   # Values for BAQ Compressed Data ***
         [ 3.0000,  3.0000,  3.1200,  3.5500,  0.0000,  0.0000,  0.0000,  0.0000,  0.0000,  0.0000,  0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000],
@@ -549,6 +552,7 @@ SIMPLE_RECONSTRUCTION_METHOD = [
 
 # Table 5.2-2 from Page 79
 BRC_TO_M_CODE = [3, 4, 6, 9, 15]
+BAQ_MODE_TO_M_CODE = {3: 3, 4: 7, 5: 15}
 NORMALIZED_RECONSTRUCTION_LEVELS = [
     [   # Values for BAQ Compressed Data ***
         [0.2490, 0.7680, 1.3655, 2.1864, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000, 0.0000],
@@ -637,4 +641,12 @@ ECC_CODE_TO_SENSOR_MODE = [
     'noise_characterization_iw',
     'noise_characterization_wave',
     'contingency'
-]
\ No newline at end of file
+]
+
+
+# Sampling frequency after decimation, in MHz, for each Range Decimation code. Table 5.1-1 from Page 36
+RANGE_DECIMATION_TO_SAMPLE_RATE = [
+    112.6041667, 100.0925926, 0.000000000, 83.41049387,
+    66.72839509, 56.30208336, 50.04629632, 25.02314816,
+    64.34523813, 46.91840280, 17.32371796, 54.59595962
+]
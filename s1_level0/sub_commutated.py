@@ -0,0 +1,104 @@
+"""
+By: Andrew Player
+Description: Whole-file decoding of the sub-commutated ancillary data (Tables 3.2-5 -> 3.2-10).
+             The sc_data_word_index and sc_data_word columns of every packet are scattered into a uint16 array with one row
+             per subcommutation cycle, laid out by SUB_COMM_KEY_POS, and the multi-word fields are then read straight out of
+             its big-endian bytes as floats and integers, rather than rebuilt from bit strings one packet at a time.
+"""
+
+import numpy as np
+
+from decoding import open_mmap, scan_secondary_header_fields
+from structs import SUB_COMM_KEY_POS
+
+
+NUM_SUB_COMM_WORDS = len(SUB_COMM_KEY_POS)  # Including the (unused) word index 0.
+
+
+def get_sub_comm_columns(key: str) -> slice:
+    """Returns the columns (word indices) that make up a sub-commutated field, e.g. 1:5 for 'x_axis_position'."""
+    columns = [i for i, (field_key, _) in enumerate(SUB_COMM_KEY_POS) if field_key == key]
+    if not columns:
+        raise ValueError(f'{key} is not a sub-commutated field.')
+    return slice(columns[0], columns[-1] + 1)
+
+
+def get_sub_comm_cycles(word_indices: np.ndarray, data_words: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scatters the data words of consecutive packets into one row per subcommutation cycle, where a new cycle starts
+    whenever the word index does not increase. Returns the (num_cycles, NUM_SUB_COMM_WORDS) uint16 words, a matching
+    bool array of which words were received, and the index of the first packet of each cycle.
+    Packets with an out of range word index (e.g. 0) are ignored.
+    """
+    word_indices = np.asarray(word_indices, dtype=np.int64)
+    data_words = np.asarray(data_words, dtype=np.uint16)
+    packets = np.flatnonzero((word_indices > 0) & (word_indices < NUM_SUB_COMM_WORDS))
+    word_indices = word_indices[packets]
+    if len(packets) == 0:
+        return np.zeros((0, NUM_SUB_COMM_WORDS), np.uint16), np.zeros((0, NUM_SUB_COMM_WORDS), bool), packets
+    cycle_numbers = np.concatenate(([0], np.cumsum(np.diff(word_indices) <= 0)))
+    num_cycles = cycle_numbers[-1] + 1
+    words = np.zeros((num_cycles, NUM_SUB_COMM_WORDS), dtype=np.uint16)
+    received = np.zeros((num_cycles, NUM_SUB_COMM_WORDS), dtype=bool)
+    words[cycle_numbers, word_indices] = data_words[packets]
+    received[cycle_numbers, word_indices] = True
+    first_packets = packets[np.flatnonzero(np.diff(cycle_numbers, prepend=-1))]
+    return words, received, first_packets
+
+
+def gps_time_stamps_to_seconds(time_stamps: np.ndarray) -> np.ndarray:
+    """
+    Converts 64-bit POD/Data Time Stamps (8 unused bits, 32 bits of GPS seconds, then 24 bits of sub-seconds)
+    into GPS seconds.
+    """
+    time_stamps = np.asarray(time_stamps, dtype=np.uint64)
+    seconds = (time_stamps >> np.uint64(24)) & np.uint64(0xFFFFFFFF)
+    sub_seconds = time_stamps & np.uint64(0xFFFFFF)
+    return seconds.astype(np.float64) + sub_seconds.astype(np.float64) * 2.0**-24
+
+
+def decode_sub_commutated_data(word_indices: np.ndarray, data_words: np.ndarray, complete_only: bool = True) -> dict[str, np.ndarray]:
+    """
+    Decodes the ancillary data of every subcommutation cycle in a file, given the sc_data_word_index and sc_data_word
+    columns of its packets (e.g. from decoding.scan_packet_headers). Returns a dict of arrays with one row per cycle:
+        positions:     (N, 3) ECEF positions in m
+        velocities:    (N, 3) ECEF velocities in m/s
+        pod_times:     (N, )  GPS time of the POD solution in s
+        quaternions:   (N, 4) attitude quaternions (q0, q1, q2, q3)
+        angular_rates: (N, 3) angular rates (omega_x, omega_y, omega_z)
+        times:         (N, )  GPS time of the attitude data in s
+        first_packets: (N, )  index of the first packet of the cycle
+    If complete_only is set, cycles missing any of those words (e.g. at the start and end of a file) are dropped.
+    """
+    words, received, first_packets = get_sub_comm_cycles(word_indices, data_words)
+    fields = {
+        'positions':     ('x_axis_position', 'z_axis_position', '>f8', 3),
+        'velocities':    ('x_axis_velocity', 'z_axis_velocity', '>f4', 3),
+        'pod_times':     ('pod_data_stamp',  'pod_data_stamp',  '>u8', 1),
+        'quaternions':   ('q0_quaternion',   'q3_quaternion',   '>f4', 4),
+        'angular_rates': ('omega_x',         'omega_z',         '>f4', 3),
+        'times':         ('data_time_stamp', 'data_time_stamp', '>u8', 1),
+    }
+    columns = {name: slice(get_sub_comm_columns(first).start, get_sub_comm_columns(last).stop) for name, (first, last, _, _) in fields.items()}
+    if complete_only:
+        complete = np.ones(words.shape[0], dtype=bool)
+        for field_columns in columns.values():
+            complete &= received[:, field_columns].all(axis=1)
+        words = words[complete]
+        first_packets = first_packets[complete]
+    big_endian_words = words.astype('>u2')
+    sub_commutated_data = {}
+    for name, (_, _, dtype, width) in fields.items():
+        values = np.ascontiguousarray(big_endian_words[:, columns[name]]).view(dtype)
+        if dtype == '>u8':
+            sub_commutated_data[name] = gps_time_stamps_to_seconds(values[:, 0])
+        else:
+            sub_commutated_data[name] = values.reshape(-1, width).astype(np.float64)
+    sub_commutated_data['first_packets'] = first_packets
+    return sub_commutated_data
+
+
+def decode_sub_commutated_data_from_file(filename, complete_only: bool = True) -> dict[str, np.ndarray]:
+    """Decodes the sub-commutated ancillary data of a whole Level-0 file, only decoding the two header fields it needs."""
+    columns = scan_secondary_header_fields(open_mmap(filename), ['sc_data_word_index', 'sc_data_word'])
+    return decode_sub_commutated_data(columns['sc_data_word_index'], columns['sc_data_word'], complete_only)
@@ -0,0 +1,200 @@
+"""
+By: Andrew Player
+Description: Writer for synthetic Level-0 files.
+             Packets have valid primary and secondary headers and Type A, B, or D (FDBAQ) user data made from random
+             sign bits and m_codes, encoded with the BRCs and thresholds of your choosing, so that the decoders can be
+             exercised and benchmarked without real data.
+"""
+
+import numpy as np
+
+from structs import (
+    PRIMARY_HEADER,
+    PRIMARY_HEADER_FIELDS,
+    SECONDARY_HEADER,
+    SECONDARY_HEADER_FIELDS,
+    SYNC_MARKER,
+    WORD_SIZE,
+    BRC_TO_HUFFMAN_CODING,
+    BRC_TO_M_CODE,
+)
+
+
+# Field values used for every synthetic packet unless overridden, loosely based on an IW echo packet.
+SYNTHETIC_SECONDARY_HEADER = {
+    'sync_marker': SYNC_MARKER,
+    'data_take_id': 1234,
+    'ecc_number': 8,
+    'rx_channel_id': 1,
+    'baq_mode': 12,
+    'baq_block_length': 31,
+    'range_decimation': 8,
+    'rx_gain': 8,
+    'tx_ramp_rate': 0x8000 | 1234,
+    'pulse_start_frequency': 567,
+    'pulse_length': 1500,
+    'rank': 9,
+    'pri': 20000,
+    'swst': 3000,
+    'swl': 15000,
+    'polarisation': 1,
+    'temperature_compensation': 1,
+    'elevation_beam_address': 3,
+    'tx_pulse_number': 2,
+    'swath_number': 10,
+}
+
+SYNTHETIC_PRIMARY_HEADER = {
+    'secondary_header_flag': 1,
+    'process_id': 65,
+    'process_category': 12,
+    'sequence_flags': 3,
+}
+
+# (m_code, code, code length) for each BRC, sorted by m_code.
+BRC_TO_HUFFMAN_CODES = [
+    sorted((m_code, int(code, 2), len(code)) for code, m_code in coding.items())
+    for coding in BRC_TO_HUFFMAN_CODING
+]
+
+
+def pack_header(bit_lengths, field_names, values: dict) -> bytes:
+    """Packs a dict of field values (missing fields are 0) into header bytes."""
+    header = 0
+    for bit_length, name in zip(bit_lengths, field_names):
+        value = values.get(name, 0)
+        if value >> bit_length:
+            raise ValueError(f'{name} = {value} does not fit in {bit_length} bits.')
+        header = (header << bit_length) | value
+    return header.to_bytes(sum(bit_lengths) // 8, 'big')
+
+
+def pack_codes(codes: np.ndarray, code_lengths: np.ndarray) -> np.ndarray:
+    """Returns the bits (a uint8 array of 0s and 1s) of variable length codes written back to back."""
+    codes = np.asarray(codes, dtype=np.int64)
+    code_lengths = np.asarray(code_lengths, dtype=np.int64)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    max_length = int(code_lengths.max())
+    bit_positions = np.arange(max_length - 1, -1, -1)
+    bits = ((codes[:, np.newaxis] >> bit_positions) & 1).astype(np.uint8)
+    in_code = np.arange(max_length) >= (max_length - code_lengths[:, np.newaxis])
+    return bits[in_code]
+
+
+def pad_to_word(bits: np.ndarray) -> np.ndarray:
+    return np.concatenate((bits, np.zeros(-len(bits) % WORD_SIZE, dtype=np.uint8)))
+
+
+def random_fdbaq_codes(num_codes: int, brc: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Returns random signs and m_codes that are valid for brc."""
+    signs = rng.integers(0, 2, num_codes)
+    m_codes = rng.integers(0, BRC_TO_M_CODE[brc] + 1, num_codes)
+    return signs, m_codes
+
+
+def encode_fdbaq_block(signs: np.ndarray, m_codes: np.ndarray, brc: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the (codes, code lengths) of the sign bit + Huffman code of each sample in a block."""
+    huffman_codes = np.asarray(BRC_TO_HUFFMAN_CODES[brc], dtype=np.int64)
+    m_codes = np.asarray(m_codes, dtype=np.int64)
+    huffman_lengths = huffman_codes[m_codes, 2]
+    codes = (np.asarray(signs, dtype=np.int64) << huffman_lengths) | huffman_codes[m_codes, 1]
+    return codes, huffman_lengths + 1
+
+
+def encode_type_d_user_data(num_quads: int, brcs, thresholds, rng: np.random.Generator) -> bytes:
+    """
+    Encodes random FDBAQ (Type D) user data with one BRC and threshold index per block of 128 quads,
+    where the BRCs go at the start of each IE block and the thresholds at the start of each QE block.
+    """
+    num_blocks = -(-num_quads // 128)
+    if len(brcs) != num_blocks or len(thresholds) != num_blocks:
+        raise ValueError(f'{num_quads} quads need {num_blocks} BRCs and thresholds, got {len(brcs)} and {len(thresholds)}.')
+    components = []
+    for component in ['IE', 'IO', 'QE', 'QO']:
+        codes = []
+        code_lengths = []
+        for i, brc in enumerate(brcs):
+            if component == 'IE':
+                codes.append([brc])
+                code_lengths.append([3])
+            if component == 'QE':
+                codes.append([thresholds[i]])
+                code_lengths.append([8])
+            num_codes = min(128, num_quads - 128 * i)
+            block_codes, block_code_lengths = encode_fdbaq_block(*random_fdbaq_codes(num_codes, brc, rng), brc)
+            codes.append(block_codes)
+            code_lengths.append(block_code_lengths)
+        components.append(pad_to_word(pack_codes(np.concatenate(codes), np.concatenate(code_lengths))))
+    return np.packbits(np.concatenate(components)).tobytes()
+
+
+def encode_type_a_b_user_data(num_quads: int, rng: np.random.Generator) -> bytes:
+    """Encodes random bypass (Type A/B) user data: a sign bit and a 9 bit m_code per sample."""
+    components = []
+    for _ in range(4):
+        codes = (rng.integers(0, 2, num_quads) << 9) | rng.integers(0, 512, num_quads)
+        components.append(pad_to_word(pack_codes(codes, np.full(num_quads, 10))))
+    return np.packbits(np.concatenate(components)).tobytes()
+
+
+def build_packet(user_data: bytes, sequence_count: int = 0, **secondary_header_values) -> bytes:
+    """Builds a packet around user_data, with SYNTHETIC_SECONDARY_HEADER values updated by secondary_header_values."""
+    secondary_values = dict(SYNTHETIC_SECONDARY_HEADER, **secondary_header_values)
+    secondary_header = pack_header(SECONDARY_HEADER, SECONDARY_HEADER_FIELDS, secondary_values)
+    primary_values = dict(
+        SYNTHETIC_PRIMARY_HEADER,
+        packet_sequence_count = sequence_count % 16384,
+        packet_data_length = len(secondary_header) + len(user_data) - 1
+    )
+    primary_header = pack_header(PRIMARY_HEADER, PRIMARY_HEADER_FIELDS, primary_values)
+    return primary_header + secondary_header + user_data
+
+
+def synthetic_packet_generator(
+    num_packets: int,
+    data_format: str = 'D',
+    num_quads: int = 1024,
+    brcs=None,
+    thresholds=None,
+    packets_per_burst: int = 128,
+    seed: int = 0
+):
+    """
+    Yields the bytes of num_packets synthetic packets. data_format is 'A', 'B', or 'D'. For Type D, brcs and thresholds
+    are either None (random per block), a single value for every block, or one value per block. Packets are grouped into
+    bursts of packets_per_burst (by their azimuth beam address), and the sub-commutated word index cycles through 1 -> 64.
+    """
+    rng = np.random.default_rng(seed)
+    num_blocks = -(-num_quads // 128)
+    test_mode = {'A': 0, 'B': 4, 'D': 0}[data_format]
+    baq_mode = 12 if data_format == 'D' else 0
+    for i in range(num_packets):
+        if data_format == 'D':
+            packet_brcs = rng.integers(0, 5, num_blocks) if brcs is None else np.broadcast_to(brcs, num_blocks)
+            packet_thresholds = rng.integers(0, 256, num_blocks) if thresholds is None else np.broadcast_to(thresholds, num_blocks)
+            user_data = encode_type_d_user_data(num_quads, packet_brcs, packet_thresholds, rng)
+        else:
+            user_data = encode_type_a_b_user_data(num_quads, rng)
+        yield build_packet(
+            user_data,
+            sequence_count = i,
+            coarse_time = 1_300_000_000 + i // 1000,
+            fine_time = (i % 1000) * 65,
+            test_mode = test_mode,
+            baq_mode = baq_mode,
+            sc_data_word_index = i % 64 + 1,
+            space_packet_count = i,
+            pri_count = i,
+            azimuth_beam_address = (100 * (i // packets_per_burst)) % 900 + (i % packets_per_burst) * 64 // packets_per_burst,
+            num_quadratures = num_quads,
+        )
+
+
+def write_synthetic_file(filename, num_packets: int, **kwargs) -> int:
+    """Writes num_packets synthetic packets (see synthetic_packet_generator for the options) and returns the file size."""
+    num_bytes = 0
+    with open(filename, 'wb') as raw_data:
+        for packet in synthetic_packet_generator(num_packets, **kwargs):
+            num_bytes += raw_data.write(packet)
+    return num_bytes
@@ -7,9 +7,30 @@ Description: Some basic utility functions necessary for decoding Level-0 data.
 
 import time
 
+from functools import lru_cache
+
 import numpy as np
 
-from structs import BRC_TO_HUFFMAN_START_BIT_LEN, BRC_TO_HUFFMAN_CODING, BRC_TO_HUFFMAN_CODING_SET
+from structs import (
+    BRC_TO_HUFFMAN_START_BIT_LEN,
+    BRC_TO_HUFFMAN_CODING,
+    BRC_TO_HUFFMAN_CODING_SET,
+    SIMPLE_RECONSTRUCTION_METHOD,
+    NORMALIZED_RECONSTRUCTION_LEVELS,
+    THIDX_TO_SF_ARRAY,
+    BRC_TO_THIDX,
+    BRC_TO_M_CODE,
+    BAQ_MODE_TO_THIDX,
+    BAQ_MODE_TO_M_CODE,
+)
+
+
+# Bits looked at per Huffman table lookup. Must be at least 10 (sign + longest code) and at most 17
+# so that a window always fits in the 24 bit values returned by create_bit_windows.
+HUFFMAN_LOOKUP_BITS = 12
+
+# Bits looked at per step of huffman_decode_streams, which reads them from the 32 bit values of create_bit_words.
+HUFFMAN_BATCH_LOOKUP_BITS = 16
 
 
 def create_bit_string(bytes_string: str):
@@ -45,6 +66,278 @@ def huffman_decode_for_brc(bit_string: str, brc: int):
     )
 
 
+def create_bit_windows(data) -> list[int]:
+    """
+    Returns, for every byte in data, the 24 bit integer made from that byte and the two after it.
+    Any n <= 17 bits starting at bit_index can then be read with a single shift and mask (see read_bits),
+    without building a bit string or shifting one huge integer.
+    """
+    padded = np.zeros(len(data) + 3, dtype=np.uint32)
+    padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    windows = (padded[:-2] << 16) | (padded[1:-1] << 8) | padded[2:]
+    return windows.tolist()
+
+
+def create_bit_words(data, padding: int = 0) -> np.ndarray:
+    """
+    Like create_bit_windows, but returns a numpy array of 32 bit values (any n <= 25 bits can be read from them),
+    followed by padding zero values so that reads that run past the end of data stay in bounds.
+    """
+    padded = np.zeros(len(data) + padding + 3, dtype=np.uint32)
+    padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return (padded[:-3] << 24) | (padded[1:-2] << 16) | (padded[2:-1] << 8) | padded[3:]
+
+
+def read_bits(windows: list[int], bit_index: int, num_bits: int) -> int:
+    return (windows[bit_index >> 3] >> (24 - num_bits - (bit_index & 7))) & ((1 << num_bits) - 1)
+
+
+def read_word_bits(words: np.ndarray, bit_indices: np.ndarray, num_bits: int) -> np.ndarray:
+    """Reads a num_bits wide (num_bits <= 25) unsigned value at each of the given bit indices of the words from create_bit_words."""
+    return (words[bit_indices >> 3] >> (32 - num_bits - (bit_indices & 7))) & ((1 << num_bits) - 1)
+
+
+def read_bits_at(data, bit_indices: np.ndarray, num_bits: int) -> np.ndarray:
+    """Reads a num_bits wide (num_bits <= 17) unsigned value at each of the given bit indices of data in one vectorized pass."""
+    bit_indices = np.asarray(bit_indices, dtype=np.int64)
+    if bit_indices.size == 0:
+        return np.zeros(0, dtype=np.uint32)
+    byte_start = int(bit_indices.min()) >> 3
+    byte_end = (int(bit_indices.max()) + num_bits + 7) >> 3
+    padded = np.zeros(byte_end - byte_start + 2, dtype=np.uint32)
+    padded[:byte_end - byte_start] = np.frombuffer(data, dtype=np.uint8, count=byte_end - byte_start, offset=byte_start)
+    bit_indices = bit_indices - 8 * byte_start
+    byte_indices = bit_indices >> 3
+    windows = (padded[byte_indices] << 16) | (padded[byte_indices + 1] << 8) | padded[byte_indices + 2]
+    return (windows >> (24 - num_bits - (bit_indices & 7)).astype(np.uint32)) & ((1 << num_bits) - 1)
+
+
+def read_bits_array(data, bit_index: int, count: int, num_bits: int) -> np.ndarray:
+    """Reads count back-to-back num_bits wide (num_bits <= 17) unsigned values starting at bit_index of data."""
+    return read_bits_at(data, bit_index + num_bits * np.arange(count, dtype=np.int64), num_bits)
+
+
+@lru_cache(maxsize=None)
+def get_huffman_lookup_table(brc: int, lookup_bits: int = HUFFMAN_LOOKUP_BITS) -> list[tuple]:
+    """
+    Builds the lookup table for a BRC from BRC_TO_HUFFMAN_CODING.
+    Each entry is indexed by the next lookup_bits bits of the stream and holds every complete
+    (sign, huffman code) pair that fits in those bits as (signs, m_codes, end_bit_offsets).
+    """
+    coding = BRC_TO_HUFFMAN_CODING[brc]
+    max_code_len = max(len(code) for code in coding)
+    if lookup_bits < max_code_len + 1:
+        raise ValueError(f'lookup_bits must be at least {max_code_len + 1} for BRC {brc}.')
+    table = []
+    for window in range(1 << lookup_bits):
+        bits = format(window, f'0{lookup_bits}b')
+        signs, m_codes, ends = [], [], []
+        bit_index = 0
+        while True:
+            code_start = bit_index + 1
+            code = None
+            for code_len in range(BRC_TO_HUFFMAN_START_BIT_LEN[brc], max_code_len + 1):
+                if code_start + code_len > lookup_bits:
+                    break
+                if bits[code_start:code_start + code_len] in coding:
+                    code = bits[code_start:code_start + code_len]
+                    break
+            if code is None:
+                break
+            signs.append(int(bits[bit_index]))
+            m_codes.append(coding[code])
+            bit_index = code_start + len(code)
+            ends.append(bit_index)
+        table.append((tuple(signs), tuple(m_codes), tuple(ends)))
+    return table
+
+
+def huffman_decode_block(windows: list[int], bit_index: int, brc: int, num_codes: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Decodes num_codes (sign, m_code) pairs encoded with brc starting at bit_index of the
+    windows from create_bit_windows. Returns the signs, the m_codes, and the bit index after the last code.
+    """
+    table = get_huffman_lookup_table(brc)
+    lookup_shift = 24 - HUFFMAN_LOOKUP_BITS
+    lookup_mask = (1 << HUFFMAN_LOOKUP_BITS) - 1
+    signs = []
+    m_codes = []
+    remaining = num_codes
+    while remaining > 0:
+        window = (windows[bit_index >> 3] >> (lookup_shift - (bit_index & 7))) & lookup_mask
+        entry_signs, entry_m_codes, entry_ends = table[window]
+        count = len(entry_ends)
+        if count <= remaining:
+            signs.extend(entry_signs)
+            m_codes.extend(entry_m_codes)
+            bit_index += entry_ends[-1]
+            remaining -= count
+        else:
+            signs.extend(entry_signs[:remaining])
+            m_codes.extend(entry_m_codes[:remaining])
+            bit_index += entry_ends[remaining - 1]
+            remaining = 0
+    return np.asarray(signs, dtype=np.int8), np.asarray(m_codes, dtype=np.uint8), bit_index
+
+
+@lru_cache(maxsize=None)
+def get_huffman_lookup_arrays(lookup_bits: int = HUFFMAN_BATCH_LOOKUP_BITS) -> tuple[np.ndarray, ...]:
+    """
+    The lookup tables of get_huffman_lookup_table for every BRC as flat numpy arrays, for huffman_decode_streams.
+    Entry brc * 2**lookup_bits + window holds the number of complete codes in the window, the codes themselves
+    (as sign << 7 | m_code, one per byte of a uint64), the bit offset after all of them, and (at 9 * entry + n)
+    the bit offset after the first n of them.
+    """
+    max_codes = 8  # Every sign + Huffman code is at least 2 bits long.
+    if lookup_bits > 16 or lookup_bits < 11:
+        raise ValueError('lookup_bits must be between 11 and 16.')
+    num_windows = 1 << lookup_bits
+    windows = np.arange(num_windows, dtype=np.int64)
+    counts = np.zeros((len(BRC_TO_HUFFMAN_CODING), num_windows), dtype=np.int64)
+    codes = np.zeros((len(BRC_TO_HUFFMAN_CODING), num_windows, max_codes), dtype=np.uint8)
+    ends = np.zeros((len(BRC_TO_HUFFMAN_CODING), num_windows, max_codes + 1), dtype=np.int64)
+    for brc, coding in enumerate(BRC_TO_HUFFMAN_CODING):
+        # Length and value of the first sign + code of every 11 bit prefix (11 bits fit the longest one).
+        prefix_lengths = np.zeros(1 << 11, dtype=np.int64)
+        prefix_codes = np.zeros(1 << 11, dtype=np.uint8)
+        for code, m_code in coding.items():
+            code_bits = len(code) + 1
+            for sign in (0, 1):
+                first = ((sign << len(code)) | int(code, 2)) << (11 - code_bits)
+                prefix_lengths[first:first + (1 << (11 - code_bits))] = code_bits
+                prefix_codes[first:first + (1 << (11 - code_bits))] = (sign << 7) | m_code
+        bit_offsets = np.zeros(num_windows, dtype=np.int64)
+        complete = np.ones(num_windows, dtype=bool)
+        for k in range(max_codes):
+            prefixes = ((windows << bit_offsets) & (num_windows - 1)) >> (lookup_bits - 11)
+            code_bits = prefix_lengths[prefixes]
+            complete &= bit_offsets + code_bits <= lookup_bits
+            counts[brc] += complete
+            codes[brc, complete, k] = prefix_codes[prefixes[complete]]
+            bit_offsets = np.where(complete, bit_offsets + code_bits, bit_offsets)
+            ends[brc, :, k + 1] = bit_offsets
+    # Small dtypes keep the tables that are gathered from on every step as cache friendly as they can be.
+    return (
+        counts.astype(np.int8).ravel(),
+        codes.reshape(-1, max_codes).view(np.uint64).ravel(),
+        ends[:, :, -1].astype(np.int8).ravel(),
+        ends.astype(np.int8).ravel()
+    )
+
+
+def huffman_decode_streams(
+    words: np.ndarray,
+    bit_indices: np.ndarray,
+    brcs: np.ndarray,
+    num_codes: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes num_codes (sign, m_code) pairs from each of many independent streams at once, stream k being
+    encoded with brcs[k] from bit_indices[k] of the 32 bit words from create_bit_words.
+    Every stream is stepped forward in lockstep, a whole lookup window per step, so the Python work is per window
+    of all streams rather than per code. Returns the (streams, num_codes) codes as sign << 7 | m_code, and the
+    bit index after each stream's last code.
+    """
+    counts, codes, advances, ends = get_huffman_lookup_arrays(HUFFMAN_BATCH_LOOKUP_BITS)
+    window_shift = 32 - HUFFMAN_BATCH_LOOKUP_BITS
+    window_mask = (1 << HUFFMAN_BATCH_LOOKUP_BITS) - 1
+    end_positions = np.asarray(bit_indices, dtype=np.int64).copy()
+    streams = np.arange(len(end_positions))
+    positions = end_positions.copy()
+    bases = np.asarray(brcs, dtype=np.int64) << HUFFMAN_BATCH_LOOKUP_BITS
+    remaining = np.full(len(positions), num_codes, dtype=np.int64)
+    step_streams, step_codes, step_counts = [], [], []
+    while len(streams) > 0:
+        windows = (words[positions >> 3] >> (window_shift - (positions & 7))) & window_mask
+        entries = bases + windows
+        taken = counts[entries]
+        step_streams.append(streams)
+        step_codes.append(codes[entries])
+        step_counts.append(taken)
+        positions += advances[entries]
+        remaining -= taken
+        if remaining.min() <= 0:
+            # Streams that are done only take the codes they still needed from their last window.
+            done = remaining <= 0
+            done_entries = entries[done]
+            taken[done] += remaining[done]
+            positions[done] += ends[9 * done_entries + taken[done]] - advances[done_entries]
+            end_positions[streams[done]] = positions[done]
+            keep = ~done
+            streams, positions, bases, remaining = streams[keep], positions[keep], bases[keep], remaining[keep]
+    # Put every stream's steps back together in order and keep only the codes each step actually took.
+    order = np.argsort(np.concatenate(step_streams), kind='stable')
+    step_codes = np.concatenate(step_codes)[order].view(np.uint8).reshape(-1, 8)
+    step_counts = np.concatenate(step_counts)[order]
+    decoded = step_codes[np.arange(8) < step_counts[:, None]]
+    return decoded.reshape(len(end_positions), num_codes), end_positions
+
+
+def build_reconstruction_table(
+    simple_reconstruction,
+    normalized_reconstruction_levels,
+    thidx_flags,
+    m_code_flags
+) -> np.ndarray:
+    """
+    Builds a (code, threshold_index, m_code) table of reconstructed sample magnitudes, where code is the
+    row used in the reconstruction tables (the BRC for FDBAQ). Below and at the threshold index flag the
+    simple reconstruction method is used, above it the normalized reconstruction levels times the sigma factor.
+    m_codes that are invalid for the simple reconstruction method are NaN.
+    """
+    num_m_codes = len(normalized_reconstruction_levels[0])
+    sigma_factors = np.asarray(THIDX_TO_SF_ARRAY, dtype=np.float64)
+    m_codes = np.arange(num_m_codes, dtype=np.float64)
+    table = np.empty((len(thidx_flags), len(sigma_factors), num_m_codes), dtype=np.float64)
+    for code, (thidx_flag, m_code_flag) in enumerate(zip(thidx_flags, m_code_flags)):
+        simple = table[code, :thidx_flag + 1]
+        simple[:] = np.where(m_codes < m_code_flag, m_codes, np.nan)
+        simple[:, m_code_flag] = simple_reconstruction[code][:thidx_flag + 1]
+        normal_levels = np.asarray(normalized_reconstruction_levels[code], dtype=np.float64)
+        table[code, thidx_flag + 1:] = np.outer(sigma_factors[thidx_flag + 1:], normal_levels)
+    return table
+
+
+TYPE_D_RECONSTRUCTION_TABLE = build_reconstruction_table(
+    SIMPLE_RECONSTRUCTION_METHOD[1],
+    NORMALIZED_RECONSTRUCTION_LEVELS[1],
+    BRC_TO_THIDX,
+    BRC_TO_M_CODE
+)
+
+
+# Indexed by BAQ mode - 3.
+TYPE_C_RECONSTRUCTION_TABLE = build_reconstruction_table(
+    SIMPLE_RECONSTRUCTION_METHOD[0],
+    NORMALIZED_RECONSTRUCTION_LEVELS[0],
+    [BAQ_MODE_TO_THIDX[baq_mode] for baq_mode in (3, 4, 5)],
+    [BAQ_MODE_TO_M_CODE[baq_mode] for baq_mode in (3, 4, 5)]
+)
+
+
+def build_signed_reconstruction_table(table: np.ndarray) -> np.ndarray:
+    """
+    Flattens a table from build_reconstruction_table into signed s_values indexed by
+    256 * (code * threshold indices + threshold_index) + (sign << 7 | m_code), the form that huffman_decode_streams decodes to.
+    """
+    num_codes, num_threshold_indices, num_m_codes = table.shape
+    signed_table = np.full((num_codes, num_threshold_indices, 2, 128), np.nan)
+    signed_table[:, :, 0, :num_m_codes] = table
+    signed_table[:, :, 1, :num_m_codes] = -table
+    return signed_table.ravel()
+
+
+TYPE_D_SIGNED_RECONSTRUCTION_TABLE = build_signed_reconstruction_table(TYPE_D_RECONSTRUCTION_TABLE)
+
+
+def reconstruct_s_values(table: np.ndarray, codes, threshold_indices, signs, m_codes) -> np.ndarray:
+    """Looks up the s_values for whole arrays of samples in a table from build_reconstruction_table."""
+    magnitudes = table[codes, threshold_indices, m_codes]
+    if np.isnan(magnitudes).any():
+        raise ValueError(f'm_code not valid: {m_codes[np.isnan(magnitudes)][0]}')
+    return np.where(signs, -magnitudes, magnitudes)
+
+
 def find_packet_of_type(packet_generator, packet_type: str, num_packets: int = 1000, log: bool = True, log_interval: int = 10):
     packet_index = 0
     for i in range(num_packets):
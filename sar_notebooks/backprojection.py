@@ -0,0 +1,193 @@
+"""
+By: Andrew Player
+Description: Batched, tiled time-domain backprojection.
+             The image is split into tiles of tile_size x tile_size pixels, which are formed independently (optionally on
+             a thread pool), and each tile is backprojected from pulse_batch pulses at a time. The range profiles are
+             (optionally) oversampled once up front, so that each pixel only needs a linear or short windowed-sinc lookup
+             into them, rather than an interpolator object per pulse. Memory use is set by tile_size and pulse_batch, not by
+             the size of the image.
+"""
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from scipy.fft import ifft
+
+
+SINC_HALF_WIDTH = 4      # Taps on either side of a windowed-sinc lookup.
+SINC_TABLE_STEPS = 1024  # Fractional sample positions that the windowed-sinc weights are tabulated at.
+
+
+def get_range_profiles(signal: np.ndarray, fft_length: int, oversample: int = 1, dtype=complex) -> np.ndarray:
+    """
+    Returns the (num_pulses, oversample * fft_length) range profiles of a (num_frequencies, num_pulses) signal,
+    i.e. fftshift(ifft(signal[:, pulse], fft_length)) for each pulse, with oversample - 1 extra samples between the
+    original ones (by zero-padding the spectrum).
+    """
+    num_samples = oversample * fft_length
+    spectrum = np.zeros((signal.shape[1], num_samples), dtype=complex)
+    num_frequencies = min(fft_length, signal.shape[0])
+    spectrum[:, :num_frequencies] = signal[:num_frequencies].T
+    range_profiles = oversample * ifft(spectrum, axis=1)
+    return np.roll(range_profiles, (fft_length // 2) * oversample, axis=1).astype(dtype)
+
+
+def get_tiles(image_shape: tuple[int, int], tile_size: int) -> list[tuple[slice, slice]]:
+    return [
+        (slice(row, row + tile_size), slice(column, column + tile_size))
+        for row in range(0, image_shape[0], tile_size)
+        for column in range(0, image_shape[1], tile_size)
+    ]
+
+
+def lookup_linear(range_profiles: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Linearly interpolates each row of range_profiles at the (fractional) sample positions in the same row of positions."""
+    num_samples = range_profiles.shape[1]
+    in_range = (positions >= 0) & (positions <= num_samples - 1)
+    positions = np.maximum(positions, 0)
+    indices = positions.astype(np.intp)
+    np.minimum(indices, num_samples - 2, out=indices)
+    fractions = positions - indices.astype(positions.dtype)
+    indices += np.arange(0, range_profiles.size, num_samples)[:, np.newaxis]
+    flat_profiles = range_profiles.ravel()
+    lower = flat_profiles.take(indices)
+    values = flat_profiles.take(indices + 1)
+    values -= lower
+    values *= fractions
+    values += lower
+    values *= in_range
+    return values
+
+
+@lru_cache(maxsize=8)
+def get_sinc_table(half_width: int, dtype) -> np.ndarray:
+    """Returns the Lanczos kernel weights of taps 1 - half_width -> half_width at SINC_TABLE_STEPS + 1 fractional positions."""
+    fractions = np.linspace(0, 1, SINC_TABLE_STEPS + 1)[:, np.newaxis]
+    offsets = fractions - np.arange(1 - half_width, half_width + 1)
+    table = (np.sinc(offsets) * np.sinc(offsets / half_width)).astype(dtype)
+    table.flags.writeable = False
+    return table
+
+
+def lookup_sinc(range_profiles: np.ndarray, positions: np.ndarray, half_width: int = SINC_HALF_WIDTH) -> np.ndarray:
+    """
+    Interpolates each row of range_profiles at positions with a Lanczos (sinc-windowed sinc) kernel of 2 * half_width taps,
+    with weights from a table rather than computed per pixel. The profiles should be oversampled (by 2 or more).
+    """
+    num_samples = range_profiles.shape[1]
+    padded_length = num_samples + 2 * half_width
+    padded_profiles = np.zeros((len(range_profiles), padded_length), dtype=range_profiles.dtype)
+    padded_profiles[:, half_width:half_width + num_samples] = range_profiles
+    flat_profiles = padded_profiles.ravel()
+    in_range = (positions >= 0) & (positions <= num_samples - 1)
+    positions = np.clip(positions, 0, num_samples - 1)
+    indices = positions.astype(np.int64)
+    table_rows = ((positions - indices.astype(positions.dtype)) * SINC_TABLE_STEPS + 0.5).astype(np.int64)
+    indices += np.arange(len(range_profiles))[:, np.newaxis] * padded_length + half_width
+    weights = get_sinc_table(half_width, positions.dtype).take(table_rows, axis=0)
+    values = np.zeros(positions.shape, dtype=range_profiles.dtype)
+    for tap_index, tap in enumerate(range(1 - half_width, half_width + 1)):
+        values += flat_profiles.take(indices + tap) * weights[..., tap_index]
+    values[~in_range] = 0
+    return values
+
+
+LOOKUPS = {
+    'linear': lookup_linear,
+    'sinc': lookup_sinc,
+}
+
+
+def backproject_tile(
+    image: np.ndarray,
+    tile: tuple[slice, slice],
+    range_profiles: np.ndarray,
+    range_start: float,
+    range_spacing: float,
+    sensor_positions: np.ndarray,
+    reference_ranges: np.ndarray,
+    grid_positions: np.ndarray,
+    phase_rate: float,
+    interpolation: str,
+    pulse_batch: int
+) -> None:
+    """Backprojects every pulse onto one tile of image, pulse_batch pulses at a time."""
+    lookup = LOOKUPS[interpolation]
+    real_dtype = range_profiles.real.dtype
+    tile_shape = image[tile].shape
+    pixels = grid_positions[:, tile[0], tile[1]].reshape(3, -1)
+    pixel_norms = (pixels**2).sum(axis=0)
+    tile_image = np.zeros(pixels.shape[1], dtype=image.dtype)
+    for start in range(0, len(range_profiles), pulse_batch):
+        pulses = slice(start, start + pulse_batch)
+        sensors = sensor_positions[pulses]
+        # |sensor - pixel|^2 as a matrix product; in float64, since the ranges are differenced against the reference range.
+        ranges = -2 * (sensors @ pixels)
+        ranges += (sensors**2).sum(axis=1)[:, np.newaxis]
+        ranges += pixel_norms
+        np.sqrt(ranges, out=ranges)
+        ranges -= reference_ranges[pulses, np.newaxis]
+        ranges = ranges.astype(real_dtype, copy=False)
+        values = lookup(range_profiles[pulses], (ranges - real_dtype.type(range_start)) / real_dtype.type(range_spacing))
+        ranges *= real_dtype.type(phase_rate)
+        phases = np.empty(ranges.shape, dtype=range_profiles.dtype)
+        np.cos(ranges, out=phases.real)
+        np.sin(ranges, out=phases.imag)
+        values *= phases
+        tile_image += values.sum(axis=0)
+    image[tile] = tile_image.reshape(tile_shape)
+
+
+def backproject(
+    range_profiles: np.ndarray,
+    range_start: float,
+    range_spacing: float,
+    sensor_positions: np.ndarray,
+    reference_ranges: np.ndarray,
+    grid_x: np.ndarray,
+    grid_y: np.ndarray,
+    grid_z: np.ndarray,
+    phase_rate: float,
+    interpolation: str = 'linear',
+    tile_size: int = 32,
+    pulse_batch: int = 32,
+    num_threads: int = 1
+) -> np.ndarray:
+    """
+    Forms an image on the grid from (num_pulses, num_samples) range profiles, where sample i of each profile is at
+    range_start + i * range_spacing from that pulse's reference range and everything outside of the profile is 0.
+    Each pulse adds lookup(range - reference_range) * exp(1j * phase_rate * (range - reference_range)) to every pixel,
+    where range is the distance from the sensor (a row of the (num_pulses, 3) sensor_positions) to the pixel.
+    interpolation is 'linear' or 'sinc'. The image has the dtype of range_profiles (complex or np.complex64).
+    """
+    if interpolation not in LOOKUPS:
+        raise ValueError(f'interpolation must be one of {list(LOOKUPS)}, got {interpolation}.')
+    sensor_positions = np.asarray(sensor_positions, dtype=np.float64)
+    reference_ranges = np.broadcast_to(np.asarray(reference_ranges, dtype=np.float64), len(range_profiles))
+    grid_positions = np.stack([grid_x, grid_y, grid_z]).astype(np.float64, copy=False)
+    image = np.zeros(grid_positions.shape[1:], dtype=range_profiles.dtype)
+
+    def form_tile(tile):
+        backproject_tile(
+            image,
+            tile,
+            range_profiles,
+            range_start,
+            range_spacing,
+            sensor_positions,
+            reference_ranges,
+            grid_positions,
+            phase_rate,
+            interpolation,
+            pulse_batch
+        )
+
+    tiles = get_tiles(image.shape, tile_size)
+    if num_threads > 1:
+        with ThreadPoolExecutor(num_threads) as executor:
+            list(executor.map(form_tile, tiles))
+    else:
+        for tile in tiles:
+            form_tile(tile)
+    return image
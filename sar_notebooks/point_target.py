@@ -1,11 +1,13 @@
 import numpy as np
-import scipy
 
-import scipy.integrate
-import scipy.interpolate
-from scipy.fft import ifft, fftshift
+from concurrent.futures import ThreadPoolExecutor
+
 from scipy.constants import pi, c
 
+from backprojection import backproject, get_range_profiles
+from factorized_backprojection import factorized_backproject
+from polar_format import polar_format_image
+
 
 class PointTargetKSpace:
     def __init__(
@@ -18,7 +20,10 @@ class PointTargetKSpace:
             image_bins,
             azimuth_span,
             initial_frequency,
-            bandwidth
+            bandwidth,
+            dtype=complex,
+            memory_budget: int = 2**28,
+            num_threads: int = 1
     ):
         self.range_to_center   = range_to_center
         self.image_length_x    = image_dimensions[0]
@@ -35,6 +40,12 @@ class PointTargetKSpace:
         self.target_locations_y = target_locations_y
         self.target_rcs = target_rcs
 
+        # Simulation settings: the signal dtype (complex or np.complex64), the bytes of temporaries
+        # allowed per thread, and the number of threads that azimuth chunks are split over.
+        self.dtype         = np.dtype(dtype)
+        self.memory_budget = memory_budget
+        self.num_threads   = num_threads
+
         self._set_range_space()
         self._set_frequency_space()
         self._set_azimuth_space()
@@ -74,27 +85,58 @@ class PointTargetKSpace:
         self.sensor_z = np.zeros(self.sensor_x.shape)
 
 
+    def _get_chunk_sizes(self, num_azimuths: int) -> tuple[int, int]:
+        """Returns the (azimuth, target) chunk sizes that keep the (azimuth, target) temporaries in the memory budget."""
+        num_targets = len(self.target_rcs)
+        bytes_per_element = 16 + 2 * self.dtype.itemsize  # float64 ranges and phases + the complex step and returns.
+        elements = max(1, self.memory_budget // bytes_per_element)
+        target_chunk = min(num_targets, max(1, elements // num_azimuths))
+        if target_chunk > 1:
+            return num_azimuths, target_chunk
+        return min(num_azimuths, elements), 1
+
+
+    def _add_target_returns(self, signal, cos_azs, sin_azs, azimuth_slice, resync_interval: int = 32):
+        """
+        Adds the returns of every target to the signal columns in azimuth_slice, in chunks of targets.
+        The frequencies are evenly spaced, so the returns at each frequency are those at the previous one times a fixed
+        (azimuth, target) step, which saves a complex exponential per sample. The returns are recomputed exactly every
+        resync_interval frequencies so that rounding errors do not build up.
+        """
+        cos_azs = cos_azs[azimuth_slice]
+        sin_azs = sin_azs[azimuth_slice]
+        _, target_chunk = self._get_chunk_sizes(len(cos_azs))
+        targets_x = np.asarray(self.target_locations_x, dtype=np.float64)
+        targets_y = np.asarray(self.target_locations_y, dtype=np.float64)
+        targets_rcs = np.asarray(self.target_rcs).astype(self.dtype)
+        wavenumber_delta = self.wavenumbers[1] - self.wavenumbers[0] if self.num_samples_freq > 1 else 0.0
+        for start in range(0, len(targets_rcs), target_chunk):
+            targets = slice(start, start + target_chunk)
+            ranges_to_targets = np.outer(cos_azs, targets_x[targets]) + np.outer(sin_azs, targets_y[targets])
+            step = np.exp(2j * wavenumber_delta * ranges_to_targets).astype(self.dtype)
+            for k_index, wavenumber in enumerate(self.wavenumbers):
+                if k_index % resync_interval == 0:
+                    returns = np.exp(2j * wavenumber * ranges_to_targets).astype(self.dtype)
+                else:
+                    returns *= step
+                signal[k_index, azimuth_slice] += returns @ targets_rcs[targets]
+
+
     def _set_k_space(self):
-        signal = np.zeros((self.num_samples_freq, self.num_samples_az), dtype=complex)
-        kx = np.zeros_like(signal)
-        ky = np.zeros_like(signal)
         cos_azs = np.cos(np.radians(self.azimuths))
         sin_azs = np.sin(np.radians(self.azimuths))
-        k_index = 0
-        for azimuth, cos_az, sin_az in zip(self.azimuths, cos_azs, sin_azs):
-            line_of_sight = [cos_az, sin_az]
-            kx[:, k_index] = self.wavenumbers * cos_az
-            ky[:, k_index] = self.wavenumbers * sin_az
-            for target_x, target_y, target_rcs in zip(
-                self.target_locations_x,
-                self.target_locations_y,
-                self.target_rcs
-            ):
-                range_to_target = np.dot(line_of_sight, [target_x, target_y])
-                signal[:, k_index] += target_rcs * np.exp(1j * 2 * self.wavenumbers * range_to_target)
-            k_index += 1
-        self.kx = kx
-        self.ky = ky
+        signal = np.zeros((self.num_samples_freq, self.num_samples_az), dtype=self.dtype)
+        azimuth_chunk, _ = self._get_chunk_sizes(self.num_samples_az)
+        azimuth_chunk = min(azimuth_chunk, -(-self.num_samples_az // self.num_threads))
+        azimuth_slices = [slice(start, start + azimuth_chunk) for start in range(0, self.num_samples_az, azimuth_chunk)]
+        if self.num_threads > 1:
+            with ThreadPoolExecutor(self.num_threads) as executor:
+                list(executor.map(lambda azimuth_slice: self._add_target_returns(signal, cos_azs, sin_azs, azimuth_slice), azimuth_slices))
+        else:
+            for azimuth_slice in azimuth_slices:
+                self._add_target_returns(signal, cos_azs, sin_azs, azimuth_slice)
+        self.kx = np.outer(self.wavenumbers, cos_azs).astype(self.dtype)
+        self.ky = np.outer(self.wavenumbers, sin_azs).astype(self.dtype)
         self.signal = signal
         self.los_vectors = np.asarray([cos_azs, sin_azs])
 
@@ -106,22 +148,92 @@ class PointTargetKSpace:
         self.filtered_signal = self.signal * self.filter_coefficients
 
 
-    def get_backprojection(self, num_pulses: int = 0):
+    def get_backprojection(
+            self,
+            num_pulses: int = 0,
+            oversample: int = 1,
+            interpolation: str = 'linear',
+            tile_size: int = 32,
+            pulse_batch: int = 32,
+            num_threads: int = None,
+            dtype=None,
+            method: str = 'direct',
+            factor: int = 2,
+            depth: int = None,
+            interpolation_order: int = 3,
+            angle_oversample: float = 4.0
+    ):
+        """
+        Backprojects the first num_pulses + 1 pulses (all of them if num_pulses is 0) onto the image grid.
+        method is 'direct' (see backprojection.backproject for oversample, interpolation ('linear' or 'sinc'),
+        tile_size, and pulse_batch) or 'factorized' (see factorized_backprojection.factorized_backproject for factor,
+        depth, interpolation_order, and angle_oversample). num_threads and dtype default to the ones given to the constructor.
+        """
         fft_length = int(8 * np.ceil(np.log2(self.num_samples_freq)))
         range_extent = c / (2 * self.frequency_delta)
-        range_window = np.linspace(-0.5 * range_extent, 0.5 * range_extent, fft_length)
-        backprojected_image = np.zeros(self.image_grid_x.shape, dtype=complex)
-        chirp_rate = 1j * 4 * pi * (1 / self.wavelength)
-        if not isinstance(self.range_to_center, list):
-            self.range_to_center *= np.ones(len(self.sensor_x))
-        index = 0
-        for x, y, z in zip(self.sensor_x, self.sensor_y, self.sensor_z):
-            range_profile = fftshift(ifft(self.signal[:, index], fft_length))
-            ranges = np.sqrt((x - self.image_grid_x)**2 + (y - self.image_grid_y)**2 + (z - self.image_grid_z)**2)
-            range_image = ranges - self.range_to_center[index]
-            interpolater = scipy.interpolate.interp1d(range_window, range_profile, kind='linear', bounds_error=False, fill_value=0.0)
-            backprojected_image += interpolater(range_image) * np.exp(chirp_rate * range_image)
-            if num_pulses != 0 and num_pulses == index:
-                break
-            index += 1
-        return backprojected_image
\ No newline at end of file
+        pulses = slice(0, num_pulses + 1 if num_pulses != 0 else None)
+        range_profiles = get_range_profiles(
+            self.signal[:, pulses],
+            fft_length,
+            oversample,
+            self.dtype if dtype is None else dtype
+        )
+        geometry = dict(
+            range_start = -0.5 * range_extent,
+            range_spacing = range_extent / (fft_length - 1) / oversample,
+            sensor_positions = np.stack([self.sensor_x, self.sensor_y, self.sensor_z], axis=1)[pulses],
+            reference_ranges = np.broadcast_to(self.range_to_center, len(self.sensor_x))[pulses],
+            grid_x = self.image_grid_x,
+            grid_y = self.image_grid_y,
+            grid_z = self.image_grid_z,
+            phase_rate = 4 * pi / self.wavelength
+        )
+        num_threads = self.num_threads if num_threads is None else num_threads
+        if method == 'direct':
+            return backproject(
+                range_profiles,
+                **geometry,
+                interpolation = interpolation,
+                tile_size = tile_size,
+                pulse_batch = pulse_batch,
+                num_threads = num_threads
+            )
+        if method == 'factorized':
+            return factorized_backproject(
+                range_profiles,
+                **geometry,
+                factor = factor,
+                depth = depth,
+                interpolation_order = interpolation_order,
+                angle_oversample = angle_oversample,
+                tile_size = tile_size,
+                num_threads = num_threads
+            )
+        raise ValueError(f"method must be 'direct' or 'factorized', got {method}.")
+
+
+    def get_polar_format_image(
+            self,
+            azimuth_span=None,
+            num_kx: int = None,
+            num_ky: int = None,
+            interpolation_order: int = 1,
+            fft_shape: tuple[int, int] = None
+    ):
+        """
+        Forms the image of the pulses within azimuth_span (degrees, all of them by default) with the polar format algorithm,
+        returning the (y, x) image and its x and y axes. See polar_format.PolarFormatPlan for the other options.
+        """
+        pulses = np.ones(self.num_samples_az, dtype=bool)
+        if azimuth_span is not None:
+            pulses = (self.azimuths >= azimuth_span[0]) & (self.azimuths <= azimuth_span[1])
+        return polar_format_image(
+            self.signal[:, pulses],
+            self.wavenumbers,
+            np.radians(self.azimuths[pulses]),
+            num_kx = num_kx,
+            num_ky = num_ky,
+            interpolation_order = interpolation_order,
+            fft_shape = fft_shape,
+            workers = self.num_threads
+        )
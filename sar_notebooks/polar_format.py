@@ -0,0 +1,208 @@
+"""
+By: Andrew Player
+Description: Polar format algorithm (PFA).
+             The k-space samples of a collection lie on a polar raster, (k * cos(azimuth), k * sin(azimuth)), which is
+             resampled onto a rectangular (kx, ky) grid so that the image is a 2-D FFT of it (see
+             polar_format_algorithm.ipynb). The resampling is done in two separable 1-D steps: along each pulse, from k to
+             the uniform kx grid, and then along each kx column, from the pulse azimuths to the uniform ky grid. Both steps
+             only depend on the collection geometry, so their weights are multiplied into a single sparse matrix, a
+             PolarFormatPlan, which get_polar_format_plan caches so that repeated images of the same geometry only pay for
+             a sparse matrix product and an FFT.
+
+             Wavenumbers and azimuths (in radians, within +-90 degrees) must be evenly spaced.
+
+Usage:       python polar_format.py [--tolerance METERS] checks the target positions of a PFA image against backprojection.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import scipy.sparse
+
+from functools import lru_cache
+from scipy.fft import fft2, fftshift
+
+from factorized_backprojection import INTERPOLATION_TAPS, get_interpolation_weights
+
+
+def get_uniform_axis(values, name: str) -> tuple[float, float, int]:
+    """Returns the (start, spacing, count) of evenly spaced values."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        raise ValueError(f'{name} needs at least 2 values.')
+    spacing = (values[-1] - values[0]) / (len(values) - 1)
+    if not np.allclose(np.diff(values), spacing, rtol=1e-6, atol=0):
+        raise ValueError(f'{name} must be evenly spaced.')
+    return float(values[0]), float(spacing), len(values)
+
+
+def get_interpolation_entries(positions: np.ndarray, num_samples: int, order: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (..., taps) sample indices and weights that interpolate a uniformly sampled signal at fractional sample
+    positions, with zero weights for positions outside of the samples.
+    """
+    in_range = (positions >= 0) & (positions <= num_samples - 1)
+    floors = np.floor(positions)
+    weights = np.stack(get_interpolation_weights(positions - floors, order), axis=-1) * in_range[..., np.newaxis]
+    indices = np.clip(floors.astype(np.intp)[..., np.newaxis] + INTERPOLATION_TAPS[order], 0, num_samples - 1)
+    return indices, weights
+
+
+class PolarFormatPlan:
+    """
+    Resamples (num_wavenumbers, num_azimuths) polar k-space signals onto a (num_ky, num_kx) rectangular grid spanning
+    the bounding box of the polar samples (zero outside of them), with interpolation_order 1 (linear) or 3 (cubic).
+    wavenumber_axis and azimuth_axis are (start, spacing, count), with azimuths in radians.
+    """
+
+    def __init__(self, wavenumber_axis: tuple, azimuth_axis: tuple, num_kx: int, num_ky: int, interpolation_order: int = 1):
+        if interpolation_order not in INTERPOLATION_TAPS:
+            raise ValueError(f'interpolation_order must be one of {list(INTERPOLATION_TAPS)}, got {interpolation_order}.')
+        wavenumber_start, wavenumber_spacing, num_wavenumbers = wavenumber_axis
+        azimuth_start, azimuth_spacing, num_azimuths = azimuth_axis
+        wavenumbers = wavenumber_start + np.arange(num_wavenumbers) * wavenumber_spacing
+        azimuths = azimuth_start + np.arange(num_azimuths) * azimuth_spacing
+        if np.abs(azimuths).max() >= np.pi / 2:
+            raise ValueError('Azimuths must be within +-90 degrees.')
+        self.num_wavenumbers = num_wavenumbers
+        self.num_azimuths = num_azimuths
+        kx = np.outer(wavenumbers, np.cos(azimuths))
+        ky = np.outer(wavenumbers, np.sin(azimuths))
+        self.kx = np.linspace(kx.min(), kx.max(), num_kx)
+        self.ky = np.linspace(ky.min(), ky.max(), num_ky)
+
+        # Range step: pulse n is sampled at k = kx / cos(azimuth_n), giving the (num_kx, num_azimuths) intermediate grid.
+        positions = (self.kx[:, np.newaxis] / np.cos(azimuths) - wavenumber_start) / wavenumber_spacing
+        indices, weights = get_interpolation_entries(positions, num_wavenumbers, interpolation_order)
+        pulses = np.arange(num_azimuths)[np.newaxis, :, np.newaxis]
+        rows = np.broadcast_to((np.arange(num_kx)[:, np.newaxis] * num_azimuths)[..., np.newaxis] + pulses, indices.shape)
+        range_step = scipy.sparse.csr_matrix(
+            (weights.ravel(), (rows.ravel(), (indices * num_azimuths + pulses).ravel())),
+            shape=(num_kx * num_azimuths, num_wavenumbers * num_azimuths)
+        )
+
+        # Azimuth step: column kx_j is sampled at azimuth arctan(ky / kx_j), giving the (num_ky, num_kx) grid.
+        positions = (np.arctan2(self.ky[:, np.newaxis], self.kx) - azimuth_start) / azimuth_spacing
+        indices, weights = get_interpolation_entries(positions, num_azimuths, interpolation_order)
+        columns = np.arange(num_kx)[np.newaxis, :, np.newaxis]
+        rows = np.broadcast_to(np.arange(num_ky * num_kx).reshape(num_ky, num_kx, 1), indices.shape)
+        azimuth_step = scipy.sparse.csr_matrix(
+            (weights.ravel(), (rows.ravel(), (columns * num_azimuths + indices).ravel())),
+            shape=(num_ky * num_kx, num_kx * num_azimuths)
+        )
+
+        self.matrix = (azimuth_step @ range_step).tocsr()
+        self.matrix.eliminate_zeros()
+
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.ky), len(self.kx)
+
+
+    def resample(self, signal: np.ndarray) -> np.ndarray:
+        """Returns the (num_ky, num_kx) rectangular grid of a (num_wavenumbers, num_azimuths) signal, or of a stack of them (..., num_ky, num_kx)."""
+        signal = np.asarray(signal)
+        if signal.shape[:2] != (self.num_wavenumbers, self.num_azimuths):
+            raise ValueError(f'Expected a ({self.num_wavenumbers}, {self.num_azimuths}) signal, got {signal.shape}.')
+        stack_shape = signal.shape[2:]
+        grids = self.matrix @ signal.reshape(self.num_wavenumbers * self.num_azimuths, -1)
+        grids = np.moveaxis(grids.reshape(*self.shape, -1), -1, 0).astype(signal.dtype, copy=False)
+        return grids.reshape(*stack_shape, *self.shape)
+
+
+    def get_image_axes(self, fft_shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the x and y coordinates of the pixels of an image formed with fft_shape, with the origin at fft_shape // 2.
+        The pixel spacing is pi / (N * dk) rather than 2 * pi / (N * dk), since the returns have two-way phases.
+        """
+        x = (np.arange(fft_shape[1]) - fft_shape[1] // 2) * np.pi / (fft_shape[1] * (self.kx[1] - self.kx[0]))
+        y = (np.arange(fft_shape[0]) - fft_shape[0] // 2) * np.pi / (fft_shape[0] * (self.ky[1] - self.ky[0]))
+        return x, y
+
+
+    def form_image(self, signal: np.ndarray, fft_shape: tuple[int, int] = None, workers: int = None) -> np.ndarray:
+        """
+        Returns the (y, x) image (or stack of images) of a signal, zero-padded to fft_shape (the grid shape by default).
+        The samples are two-way returns exp(+2j k.r) of targets at r, so the image is their forward FFT (an inverse FFT
+        would give the point-reflected scene), scaled by 1 / N like an inverse FFT.
+        """
+        fft_shape = self.shape if fft_shape is None else fft_shape
+        grids = self.resample(signal)
+        return fftshift(fft2(grids, fft_shape, norm='forward', workers=workers), axes=(-2, -1))
+
+
+@lru_cache(maxsize=16)
+def get_cached_polar_format_plan(wavenumber_axis: tuple, azimuth_axis: tuple, num_kx: int, num_ky: int, interpolation_order: int) -> PolarFormatPlan:
+    return PolarFormatPlan(wavenumber_axis, azimuth_axis, num_kx, num_ky, interpolation_order)
+
+
+def get_polar_format_plan(wavenumbers, azimuths, num_kx: int = None, num_ky: int = None, interpolation_order: int = 1) -> PolarFormatPlan:
+    """
+    Returns the (cached) plan for a collection geometry: evenly spaced wavenumbers (rad/m) and azimuths (radians).
+    The grid is num_kx x num_ky, by default as many wavenumbers x azimuths.
+    """
+    wavenumber_axis = get_uniform_axis(wavenumbers, 'wavenumbers')
+    azimuth_axis = get_uniform_axis(azimuths, 'azimuths')
+    num_kx = wavenumber_axis[2] if num_kx is None else num_kx
+    num_ky = azimuth_axis[2] if num_ky is None else num_ky
+    return get_cached_polar_format_plan(wavenumber_axis, azimuth_axis, num_kx, num_ky, interpolation_order)
+
+
+def polar_format_image(
+    signal: np.ndarray,
+    wavenumbers,
+    azimuths,
+    num_kx: int = None,
+    num_ky: int = None,
+    interpolation_order: int = 1,
+    fft_shape: tuple[int, int] = None,
+    workers: int = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Forms the image of a (num_wavenumbers, num_azimuths) signal by PFA, returning the (y, x) image and its x and y axes."""
+    plan = get_polar_format_plan(wavenumbers, azimuths, num_kx, num_ky, interpolation_order)
+    fft_shape = plan.shape if fft_shape is None else fft_shape
+    x, y = plan.get_image_axes(fft_shape)
+    return plan.form_image(signal, fft_shape, workers), x, y
+
+
+def get_peak_locations(image: np.ndarray, x: np.ndarray, y: np.ndarray, num_peaks: int, exclusion: float) -> list[tuple]:
+    """Returns the (x, y) locations of the num_peaks brightest peaks of a (y, x) image, at least exclusion meters apart."""
+    magnitude = np.abs(image)
+    locations = []
+    for _ in range(num_peaks):
+        row, column = np.unravel_index(magnitude.argmax(), magnitude.shape)
+        locations.append((float(x[column]), float(y[row])))
+        magnitude[(np.abs(y - y[row]) < exclusion)[:, np.newaxis] & (np.abs(x - x[column]) < exclusion)] = 0
+    return sorted(locations)
+
+
+def check_against_backprojection(tolerance: float = 1.0) -> bool:
+    """
+    Images two off-center targets, placed asymmetrically so that a mirrored image cannot match, with PFA and with
+    direct backprojection, and prints the peak locations of both. Returns whether each PFA peak is within tolerance
+    meters of the backprojection one.
+    """
+    from point_target import PointTargetKSpace  # Imported here, since point_target imports this module.
+
+    targets_x = [25, -10]
+    targets_y = [-15, 20]
+    target = PointTargetKSpace(1000, targets_x, targets_y, [15, 15], (80, 80), (160, 160), (-1, 1), 5e9, 300e6)
+    image, x, y = target.get_polar_format_image(num_kx = 256, num_ky = 256, fft_shape = (1024, 1024))
+    pfa_peaks = get_peak_locations(image, x, y, len(targets_x), 5.0)
+    backprojection = target.get_backprojection(oversample = 4)
+    backprojection_peaks = get_peak_locations(backprojection, target.x, target.y, len(targets_x), 5.0)
+    print('        targets: ' + ', '.join(f'({x:.2f}, {y:.2f})' for x, y in sorted(zip(targets_x, targets_y))))
+    print('            PFA: ' + ', '.join(f'({x:.2f}, {y:.2f})' for x, y in pfa_peaks))
+    print(' backprojection: ' + ', '.join(f'({x:.2f}, {y:.2f})' for x, y in backprojection_peaks))
+    return all(np.hypot(x0 - x1, y0 - y1) <= tolerance for (x0, y0), (x1, y1) in zip(pfa_peaks, backprojection_peaks))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the target positions of a PFA image against backprojection.')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Max distance between the peaks, in meters.')
+    args = parser.parse_args()
+
+    if not check_against_backprojection(args.tolerance):
+        sys.exit(f'PFA and backprojection peaks are more than {args.tolerance} m apart.')
@@ -0,0 +1,177 @@
+"""
+By: Andrew Player
+Description: Out-of-core Range-Doppler Algorithm (RDA) for stripmap data, following range_doppler.ipynb.
+             The raw (azimuth, range) signal can be a memory-mapped array (e.g. np.load(..., mmap_mode='r')), and is
+             processed in two passes that only ever hold a block of it in memory:
+                 1. Range compression, line_block range lines at a time. Each block is transposed as it is written to a
+                    (range, azimuth) work file, so that the second pass reads whole azimuth lines.
+                 2. Azimuth FFT, RCMC, inverse azimuth FFT, and azimuth compression, column_block range columns at a time
+                    (plus the extra columns that RCMC shifts into the block). Each block is transposed back as it is
+                    written to the (azimuth, range) image.
+             Every FFT runs on a whole block with scipy.fft, using workers threads.
+
+             Example:
+                 processor = RangeDopplerProcessor(frequency, range_center, synthetic_aperture, synthetic_aperture[-1])
+                 image = processor.focus(np.load('signal.npy', mmap_mode='r'), output='image.npy')
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from scipy.constants import pi, c
+from scipy.fft import fft, ifft, fftshift, ifftshift
+
+
+class RangeDopplerProcessor:
+    """
+    Focuses (num_samples_az, num_samples_range) stepped-frequency signals, where frequency holds the frequencies of the
+    range samples, range_to_center the range to the scene center (or one per azimuth line, of which the middle is used),
+    and azimuth_positions the position of the sensor along track for each azimuth line.
+    The image is (azimuth_fft_length, range_fft_length), by default the next power of 2 above the number of azimuth
+    lines and 16 times the next power of 2 above the number of range samples, as in the notebook.
+    """
+
+    def __init__(
+            self,
+            frequency,
+            range_to_center,
+            azimuth_positions,
+            effective_velocity: float,
+            pulse_repetition_frequency: float = 850,
+            range_fft_length: int = None,
+            azimuth_fft_length: int = None,
+            line_block: int = 256,
+            column_block: int = 256,
+            workers: int = None,
+            dtype=complex,
+            work_dir=None
+    ):
+        self.frequency = np.asarray(frequency, dtype=np.float64)
+        range_to_center = np.atleast_1d(np.asarray(range_to_center, dtype=np.float64))
+        self.range_to_center = range_to_center[len(range_to_center) // 2]
+        self.azimuth_positions = np.asarray(azimuth_positions, dtype=np.float64)
+        self.effective_velocity = effective_velocity
+        self.pulse_repetition_frequency = pulse_repetition_frequency
+
+        self.num_samples_az = len(self.azimuth_positions)
+        self.num_samples_range = len(self.frequency)
+        self.range_fft_length = range_fft_length or int(16 * (2 ** np.ceil(np.log2(self.num_samples_range))))
+        self.azimuth_fft_length = azimuth_fft_length or int(2 ** np.ceil(np.log2(self.num_samples_az)))
+
+        # Processing settings: the range lines per block of the first pass, the range columns per block of the second,
+        # the threads per FFT, the dtype of the work file and image, and where the work file goes (the system temp dir by default).
+        self.line_block   = line_block
+        self.column_block = column_block
+        self.workers      = workers
+        self.dtype        = np.dtype(dtype)
+        self.work_dir     = work_dir
+
+        self._set_range_space()
+        self._set_range_filter()
+        self._set_range_offsets()
+
+
+    def _set_range_space(self):
+        self.center_frequency = self.frequency[len(self.frequency) // 2]
+        self.wavelength = c / self.center_frequency
+        range_window_length = c / (2 * (self.frequency[1] - self.frequency[0]))
+        self.slant_range_window = np.linspace(-0.5 * range_window_length, 0.5 * range_window_length, self.range_fft_length)
+        self.slant_range_res = self.slant_range_window[1] - self.slant_range_window[0]
+
+
+    def _set_range_filter(self):
+        filter_coefficients = np.hamming(self.num_samples_range)
+        self.range_filter = np.exp(1j * 4 * pi * (self.frequency / c) * self.range_to_center) * filter_coefficients
+
+
+    def _set_range_offsets(self):
+        """Sets the RCMC shift (in range cells) of each Doppler frequency."""
+        frequency_shifts = np.linspace(
+            -0.5 * self.pulse_repetition_frequency,
+            0.5 * self.pulse_repetition_frequency,
+            self.num_samples_az
+        )
+        range_offsets = (
+            self.range_to_center / np.sqrt(1 - ((self.wavelength * frequency_shifts) / (2 * self.effective_velocity)) ** 2)
+        ) - self.range_to_center
+        self.range_offsets = np.round(range_offsets / self.slant_range_res).astype(np.int64)
+
+
+    def get_azimuth_filters(self, columns: slice) -> np.ndarray:
+        """Returns the (num_columns, azimuth_fft_length) azimuth matched filter spectra of a block of range columns."""
+        slant_ranges = self.slant_range_window[columns]
+        reference_frequency_slopes = (self.azimuth_positions**2) / (self.wavelength * (self.range_to_center + slant_ranges[:, np.newaxis]))
+        filter_coefficients = np.hamming(self.num_samples_az)
+        return fft(
+            np.exp(1j * 4 * pi * reference_frequency_slopes) * filter_coefficients,
+            self.azimuth_fft_length,
+            axis=1,
+            workers=self.workers
+        )
+
+
+    def range_compress(self, signal, range_lines) -> None:
+        """Range compresses signal into the (range_fft_length, num_samples_az) range_lines, line_block lines at a time."""
+        for start in range(0, self.num_samples_az, self.line_block):
+            lines = slice(start, min(start + self.line_block, self.num_samples_az))
+            block = np.asarray(signal[lines]) * self.range_filter
+            block = fftshift(ifft(block, self.range_fft_length, axis=1, workers=self.workers), axes=1)
+            range_lines[:, lines] = block.T
+
+
+    def azimuth_compress(self, range_lines, image) -> None:
+        """
+        Forms the (azimuth_fft_length, range_fft_length) image from the range compressed (range_fft_length, num_samples_az)
+        range_lines, column_block range columns at a time.
+        """
+        # RCMC moves the data at range column (column + offset) of each Doppler frequency to column, with wrap around.
+        max_offset = int(self.range_offsets.max())
+        min_offset = int(self.range_offsets.min())
+        for start in range(0, self.range_fft_length, self.column_block):
+            columns = slice(start, min(start + self.column_block, self.range_fft_length))
+            num_columns = columns.stop - columns.start
+            halo_columns = np.arange(start + min_offset, columns.stop + max_offset) % self.range_fft_length
+            block = np.asarray(range_lines[halo_columns])
+            block = fftshift(fft(block, axis=1, workers=self.workers), axes=1)
+            shifted_columns = np.arange(num_columns)[:, np.newaxis] + (self.range_offsets - min_offset)
+            block = np.take_along_axis(block, shifted_columns, axis=0)
+            block = ifft(ifftshift(block, axes=1), axis=1, workers=self.workers)
+            block = fft(block, self.azimuth_fft_length, axis=1, workers=self.workers)
+            block *= self.get_azimuth_filters(columns)
+            block = ifftshift(ifft(block, axis=1, workers=self.workers), axes=1)
+            image[:, columns] = block.T
+
+
+    def focus(self, signal, output=None) -> np.ndarray:
+        """
+        Focuses signal (an array or a memory-mapped array) and returns the (azimuth, range) image, which is written to
+        the .npy file output (and returned memory-mapped) if it is given.
+        """
+        if signal.shape != (self.num_samples_az, self.num_samples_range):
+            raise ValueError(f'Expected a ({self.num_samples_az}, {self.num_samples_range}) signal, got {signal.shape}.')
+        image_shape = (self.azimuth_fft_length, self.range_fft_length)
+        if output is None:
+            image = np.zeros(image_shape, dtype=self.dtype)
+        else:
+            image = np.lib.format.open_memmap(output, mode='w+', dtype=self.dtype, shape=image_shape)
+        work_fd, work_filename = tempfile.mkstemp(suffix='.dat', dir=self.work_dir)
+        os.close(work_fd)
+        try:
+            range_lines = np.memmap(work_filename, dtype=self.dtype, mode='w+', shape=(self.range_fft_length, self.num_samples_az))
+            self.range_compress(signal, range_lines)
+            self.azimuth_compress(range_lines, image)
+            del range_lines
+        finally:
+            os.remove(work_filename)
+        if output is not None:
+            image.flush()
+        return image
+
+
+    def get_image_axes(self, aperture_length: float) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the slant range and cross range coordinates of the image pixels."""
+        r = 0.5 * aperture_length * self.num_samples_az / self.azimuth_fft_length
+        cross_range = np.linspace(-r, r, self.azimuth_fft_length)
+        return self.slant_range_window, cross_range